@@ -0,0 +1,173 @@
+"""Non-blocking, batched logging backend for the workers.
+
+install_async_logging moves the handlers of the given loggers behind a
+queue. Callers only enqueue the record; a background thread formats the
+records and hands them to the original handlers in batches, taking each
+handler's lock once per batch instead of once per record. DEBUG chatter on hot
+paths can be sampled.
+
+Records are snapshotted when enqueued: extras and message arguments that
+aren't plain values, such as the model instances the Logger wrapper attaches,
+are replaced by their str(), so the flusher never reads objects the caller
+has since changed. A message whose arguments are all plain values is left to
+the flusher to render, so log("...%s", value) costs the caller no formatting.
+"""
+import atexit
+import copy
+import itertools
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler
+from typing import Dict, Iterable, List, Optional
+
+# Attributes every LogRecord has, anything else was passed as an extra
+_RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None))
+) | {"message", "asctime"}
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+
+class SamplingFilter(logging.Filter):
+    """Keep one record in N for the configured levels, e.g. {logging.DEBUG: 10}."""
+
+    def __init__(self, sample_rates: Dict[int, int]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self._counters = {level: itertools.count() for level in sample_rates}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.sample_rates.get(record.levelno)
+        if not rate or rate <= 1:
+            return True
+        return next(self._counters[record.levelno]) % rate == 0
+
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Snapshot what may change after the call returns; the formatting
+        # itself is left to the flusher thread
+        record = copy.copy(record)
+        if not _is_plain(record.msg) or not all(map(_is_plain, _arguments(record.args))):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not _is_plain(value):
+                setattr(record, name, str(value))
+        return record
+
+
+def _is_plain(value) -> bool:
+    return isinstance(value, _PLAIN_TYPES)
+
+
+def _arguments(args) -> Iterable:
+    # logging unwraps log("%(key)s", {"key": value}) into a mapping
+    if isinstance(args, dict):
+        return args.values()
+    return args or ()
+
+
+class BatchingQueueListener:
+    def __init__(
+        self,
+        record_queue: queue.Queue,
+        handlers: List[logging.Handler],
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+    ):
+        self.queue = record_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._stop = object()
+        self._thread = threading.Thread(
+            target=self._run, name="async-logging-flusher", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread.is_alive():
+            self.queue.put(self._stop)
+            self._thread.join()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if any(record is self._stop for record in batch):
+                batch = [record for record in batch if record is not self._stop]
+                stopping = True
+            self._emit(batch)
+
+    def _emit(self, batch: List[logging.LogRecord]) -> None:
+        if not batch:
+            return
+
+        for handler in self.handlers:
+            # Write the whole batch under one lock
+            handler.acquire()
+            try:
+                for record in batch:
+                    if record.levelno >= handler.level and handler.filter(record):
+                        try:
+                            handler.emit(record)
+                        except Exception:
+                            handler.handleError(record)
+                handler.flush()
+            finally:
+                handler.release()
+
+
+_listeners: List[BatchingQueueListener] = []
+
+
+def install_async_logging(
+    logger_names: Iterable[str] = ("",),
+    batch_size: int = 500,
+    flush_interval: float = 0.5,
+    sample_rates: Optional[Dict[int, int]] = None,
+) -> None:
+    """Move the handlers of the named loggers ("" is the root logger) behind a
+    queue flushed in batches by a background thread."""
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        handlers = [
+            handler
+            for handler in logger.handlers
+            if not isinstance(handler, _DeferredQueueHandler)
+        ]
+        if not handlers:
+            continue
+
+        record_queue = queue.Queue()
+        queue_handler = _DeferredQueueHandler(record_queue)
+        if sample_rates:
+            queue_handler.addFilter(SamplingFilter(sample_rates))
+
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handler)
+
+        listener = BatchingQueueListener(record_queue, handlers, batch_size, flush_interval)
+        listener.start()
+        _listeners.append(listener)
+
+
+@atexit.register
+def flush_async_logging() -> None:
+    """Stop the flusher threads after writing everything still queued."""
+    while _listeners:
+        _listeners.pop().stop()
@@ -0,0 +1,166 @@
+"""Band index for extracted products.
+
+A product folder is scanned once with os.scandir, its band files are
+resolved to band names, and the result is persisted as a manifest next to
+the bands mapping each band to a stable ID and its path. Later stages read
+the manifest instead of listing the folder again, and files are never
+renamed, so a worker failing half way leaves the folder untouched.
+"""
+import json
+import os
+import re
+import uuid
+from typing import List, Optional
+
+from SatProductCurator.models.constants import PRODUCT_SENTINEL1, PRODUCT_SENTINEL2
+
+MANIFEST_NAME = ".band_manifest.json"
+MANIFEST_VERSION = 1
+
+# T39RZH_20240701T064629_B01.jp2 (L1C), T39RZH_20240701T064629_B02_10m.jp2 (L2A)
+S2_BAND_PATTERN = re.compile(r"_(B\d{2}|B8A|TCI)(?:_(\d+m))?\.jp2$", re.IGNORECASE)
+
+# s1a-iw-grd-vv-20240701t020105-20240701t020130-054548-06a3f5-001.tiff
+S1_BAND_PATTERN = re.compile(
+    r"^s1[abcd]-(\w+?)-(\w{3})-(hh|hv|vh|vv)-.*\.tiff?$", re.IGNORECASE
+)
+
+# s1a-iw-raw-s-vv-20240701t020105-20240701t020130-054548-06a3f5.dat, the
+# Level-0 (S1_SAR_RAW) measurement file; its -annot.dat and -index.dat
+# companions don't match
+S1_RAW_PATTERN = re.compile(
+    r"^s1[abcd]-\w+?-raw-s-(hh|hv|vh|vv)-.*-[0-9a-f]{6}\.dat$", re.IGNORECASE
+)
+
+# SAFE folders that never hold bands, not descended into
+SKIP_FOLDERS = {"QI_DATA", "AUX_DATA", "DATASTRIP", "HTML", "rep_info", "annotation", "preview", "support"}
+
+
+def s2_band_name(file_name: str) -> Optional[str]:
+    match = S2_BAND_PATTERN.search(file_name)
+    if not match:
+        return None
+    band, resolution = match.groups()
+    return f"{band.upper()}_{resolution}" if resolution else band.upper()
+
+
+def s1_band_name(file_name: str) -> Optional[str]:
+    """Polarisation of a measurement file, prefixed with the swath for SLC products."""
+    match = S1_BAND_PATTERN.match(file_name)
+    if not match:
+        return None
+    swath, product_class, polarisation = match.groups()
+    if product_class.lower() == "slc":
+        return f"{swath.upper()}_{polarisation.upper()}"
+    return polarisation.upper()
+
+
+BAND_NAME_RESOLVERS = {
+    PRODUCT_SENTINEL2: s2_band_name,
+    PRODUCT_SENTINEL1: s1_band_name,
+}
+
+
+def scan_bands(folder: str, product: str) -> List[dict]:
+    """Walk folder once and return {"BandName", "Path", "Size"} for every band,
+    Path relative to folder. Works on a flat folder of bands or a SAFE tree.
+
+    Raises ValueError for a Sentinel-1 RAW (Level-0) product: its measurement
+    files hold unfocused echo data, not rasters a COG can be made from."""
+    resolve = BAND_NAME_RESOLVERS.get(product)
+    if resolve is None:
+        raise ValueError(f"No band naming rules for product type {product}")
+
+    bands = []
+    raw_files = 0
+    pending = [folder]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIP_FOLDERS:
+                        pending.append(entry.path)
+                    continue
+
+                if product == PRODUCT_SENTINEL1 and S1_RAW_PATTERN.match(entry.name):
+                    raw_files += 1
+                    continue
+
+                band_name = resolve(entry.name)
+                if band_name is not None:
+                    bands.append(
+                        {
+                            "BandName": band_name,
+                            "Path": os.path.relpath(entry.path, folder),
+                            "Size": entry.stat().st_size,
+                        }
+                    )
+
+    if raw_files and not bands:
+        raise ValueError(
+            f"{folder} is a Sentinel-1 RAW (Level-0) product, which has no "
+            f"image bands; search a GRD or SLC product type instead"
+        )
+    return sorted(bands, key=lambda band: band["BandName"])
+
+
+def load_manifest(folder: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("Version") != MANIFEST_VERSION or not manifest.get("Bands"):
+        return None
+    return manifest
+
+
+def build_manifest(folder: str, product: str, key: Optional[str] = None) -> dict:
+    """Scan folder and persist its manifest. key (e.g. the tile_id) seeds the
+    band IDs, so the same product always gets the same IDs. Raises ValueError
+    without saving anything when no band is found, so a folder scanned before
+    its bands were in place is scanned again next time."""
+    key = key or os.path.basename(os.path.normpath(folder))
+    bands = scan_bands(folder, product)
+    if not bands:
+        raise ValueError(f"No {product} band files found in {folder}")
+    for band in bands:
+        band["Id"] = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}/{band['Path']}"))
+
+    manifest = {
+        "Version": MANIFEST_VERSION,
+        "Product": product,
+        "Key": key,
+        "Bands": bands,
+    }
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    partial_path = f"{manifest_path}.{uuid.uuid4().hex}.part"
+    try:
+        with open(partial_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(partial_path, manifest_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return manifest
+
+
+def band_manifest(
+    folder: str, product: str, key: Optional[str] = None, rescan: bool = False
+) -> List[dict]:
+    """Target images of an extracted product as {"Id", "Path", "BandName"}.
+
+    The persisted manifest is used when present; the folder is only scanned
+    the first time or when rescan is set."""
+    manifest = None if rescan else load_manifest(folder)
+    if manifest is None:
+        manifest = build_manifest(folder, product, key)
+
+    return [
+        {
+            "Id": band["Id"],
+            "Path": os.path.join(folder, band["Path"]),
+            "BandName": band["BandName"],
+        }
+        for band in manifest["Bands"]
+    ]
@@ -0,0 +1,811 @@
+"""Offline benchmark suite for the ingestion pipeline.
+
+Runs the pipeline stages against a local stand-in provider that serves the
+recorded PEPS search response (peps-output.txt) and synthetic Sentinel-2
+products, so results don't depend on PEPS or the NAS and can be compared
+across releases.
+
+Usage:
+    DJANGO_SETTINGS_MODULE=<project>.settings python benchmark_pipeline.py \\
+        --output bench-<version>.json [--baseline bench-<previous>.json]
+
+The Django test database is created for the run and destroyed afterwards.
+With --baseline the run exits with status 1 when a benchmark's median is
+slower than the baseline by more than --tolerance, and likewise when
+importing the tile service takes longer than --import-budget or the stored
+tile lookup over --lookup-tiles tiles takes longer than --lookup-budget.
+"""
+import argparse
+import copy
+import datetime
+import hashlib
+import http.server
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+RECORDED_SEARCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "peps-output.txt")
+
+BANDS = ["B01", "B02", "B03", "B04", "B05", "B06", "B07", "B08", "B09", "B10", "B11", "B12", "B8A", "TCI"]
+
+# Abu Dhabi AOI used by the MnA collection requests
+AOI = [
+    (54.3515, 24.2482),
+    (54.3515, 24.5338),
+    (54.6371, 24.5338),
+    (54.6371, 24.2482),
+    (54.3515, 24.2482),
+]
+
+# Synthetic bands are written in UTM 40N, 10 m pixels
+SYNTHETIC_CRS = "EPSG:32640"
+SYNTHETIC_ORIGIN = (230000, 2716000)
+
+
+class StandInProvider:
+    """Serves recorded PEPS search pages and a synthetic product zip on localhost.
+
+    Search responses are built from the recorded features, repeated with unique
+    ids until total_results is reached, after search_delay seconds, or fail
+    with search_error when it is set; search_requests counts them. Downloads
+    honour Range requests; with
+    drop_after set, the first full download is cut after that many bytes.
+    product_requests records the Range header and bytes sent of each download."""
+
+    def __init__(
+        self,
+        recorded_search_path: str,
+        product_zip_path: str,
+        drop_after: Optional[int] = None,
+    ):
+        with open(recorded_search_path) as recorded_file:
+            self.recorded = json.load(recorded_file)
+        with open(product_zip_path, "rb") as product_file:
+            self.product_bytes = product_file.read()
+        self.product_checksum = hashlib.md5(self.product_bytes).hexdigest()
+        self.total_results = len(self.recorded["features"])
+        self.drop_after = drop_after
+        self.product_requests = []
+        self.search_delay = 0.0
+        self.search_error: Optional[int] = None
+        self.search_requests = 0
+
+        provider = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.endswith("/search.json"):
+                    provider._send_search(self, parse_qs(url.query))
+                elif url.path.startswith("/download/"):
+                    provider._send_product(self)
+                else:
+                    self.send_error(404)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+    def feature(self, index: int) -> dict:
+        recorded_features = self.recorded["features"]
+        feature = copy.deepcopy(recorded_features[index % len(recorded_features)])
+        product_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"benchmark-{index}"))
+        properties = feature["properties"]
+        title = f"{properties['title']}_{index:06d}"
+
+        feature["id"] = product_id
+        properties["title"] = title
+        properties["productIdentifier"] = title
+        properties["resourceSize"] = len(self.product_bytes)
+        properties["resourceChecksum"] = self.product_checksum
+        properties["services"]["download"].update(
+            url=f"{self.base_url}/download/{product_id}",
+            size=len(self.product_bytes),
+            checksum=self.product_checksum,
+        )
+        return feature
+
+    def _send_search(self, handler, query) -> None:
+        self.search_requests += 1
+        time.sleep(self.search_delay)
+        if self.search_error:
+            handler.send_error(self.search_error)
+            return
+
+        max_records = int(query.get("maxRecords", ["20"])[0])
+        page = int(query.get("page", ["1"])[0])
+        start = (page - 1) * max_records
+        end = min(start + max_records, self.total_results)
+
+        response = {key: value for key, value in self.recorded.items() if key != "features"}
+        response["properties"] = dict(
+            self.recorded["properties"],
+            totalResults=self.total_results,
+            itemsPerPage=max_records,
+            startIndex=start + 1,
+        )
+        response["features"] = [self.feature(i) for i in range(start, end)]
+        self._send(handler, 200, json.dumps(response).encode(), "application/json")
+
+    def _send_product(self, handler) -> None:
+        offset = 0
+        range_header = handler.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            offset = int(range_header[len("bytes="):].split("-")[0])
+        if offset >= len(self.product_bytes):
+            handler.send_error(416)
+            return
+
+        body = self.product_bytes[offset:]
+        handler.send_response(206 if offset else 200)
+        if offset:
+            handler.send_header(
+                "Content-Range", f"bytes {offset}-{len(self.product_bytes) - 1}/{len(self.product_bytes)}"
+            )
+        handler.send_header("Content-Type", "application/zip")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+
+        if self.drop_after is not None and not offset:
+            # Advertise the whole body, send part of it and hang up
+            sent = self.drop_after
+            self.drop_after = None
+            handler.wfile.write(body[:sent])
+            handler.wfile.flush()
+            handler.close_connection = True
+            handler.connection.shutdown(socket.SHUT_RDWR)
+        else:
+            sent = len(body)
+            handler.wfile.write(body)
+        self.product_requests.append((range_header, sent))
+
+    @staticmethod
+    def _send(handler, status: int, body: bytes, content_type: str) -> None:
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def write_synthetic_bands(folder: str, size: int) -> list:
+    """Write the 14 S2 L1C bands as size x size JP2s and return their paths."""
+    import numpy
+    import rasterio
+    from rasterio.transform import from_origin
+
+    os.makedirs(folder, exist_ok=True)
+    rng = numpy.random.default_rng(size)
+    transform = from_origin(*SYNTHETIC_ORIGIN, 10, 10)
+    paths = []
+    for band in BANDS:
+        count, dtype = (3, "uint8") if band == "TCI" else (1, "uint16")
+        path = os.path.join(folder, f"T40RBN_20240729T065621_{band}.jp2")
+        with rasterio.open(
+            path,
+            "w",
+            driver="JP2OpenJPEG",
+            width=size,
+            height=size,
+            count=count,
+            dtype=dtype,
+            crs=SYNTHETIC_CRS,
+            transform=transform,
+        ) as dst:
+            dst.write(rng.integers(0, 255 if dtype == "uint8" else 10000, (count, size, size), dtype=dtype))
+        paths.append(path)
+    return paths
+
+
+def write_synthetic_product(zip_path: str, band_paths: list) -> None:
+    """Pack the bands the way a SAFE zip lays them out."""
+    safe = "S2A_MSIL1C_20240729T065621_N0511_R063_T40RBN_20240729T104107.SAFE"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as archive:
+        for path in band_paths:
+            archive.write(
+                path,
+                f"{safe}/GRANULE/L1C_T40RBN_A047500_20240729T070507/IMG_DATA/{os.path.basename(path)}",
+            )
+
+
+def measure(name: str, size, repeat: int, run, setup=None) -> dict:
+    """Time run() repeat times. run returns (items, bytes) processed."""
+    seconds = []
+    items = processed_bytes = 0
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        items, processed_bytes = run(state) if setup else run()
+        seconds.append(time.perf_counter() - start)
+
+    median = statistics.median(seconds)
+    result = {
+        "name": name,
+        "size": size,
+        "repeat": repeat,
+        "seconds": seconds,
+        "median_seconds": median,
+        "items": items,
+        "items_per_second": items / median if median else None,
+        "bytes": processed_bytes,
+        "mb_per_second": processed_bytes / median / 1e6 if median and processed_bytes else None,
+    }
+    print(f"{name:<32} size={size!s:<8} median={median:.4f}s items={items}")
+    return result
+
+
+def run_benchmarks(args, workdir: str) -> list:
+    from django.conf import settings
+    from django.contrib.gis.geos import Polygon
+
+    from SatProductCurator.models import SatelliteImageTile, SatelliteProviderConfiguration
+    from SatProductCurator.models.constants import PRODUCT_SENTINEL2, PROVIDER_PEPS
+
+    results = []
+    small_raster = min(args.raster_sizes)
+
+    band_paths = write_synthetic_bands(os.path.join(workdir, f"bands_{small_raster}"), small_raster)
+    product_zip = os.path.join(workdir, "product.zip")
+    write_synthetic_product(product_zip, band_paths)
+
+    provider = StandInProvider(RECORDED_SEARCH, product_zip)
+    provider.start()
+
+    # Point eodag's PEPS provider at the stand-in before any gateway is built
+    os.environ["EODAG__PEPS__SEARCH__API_ENDPOINT"] = (
+        f"{provider.base_url}/resto/api/collections/{{collection}}/search.json"
+    )
+    os.environ["EODAG__PEPS__DOWNLOAD__OUTPUTS_PREFIX"] = os.path.join(workdir, "downloads")
+    os.makedirs(os.path.join(workdir, "downloads"), exist_ok=True)
+    settings.SEARCH_CACHE_PATH = os.path.join(workdir, "search_cache.sqlite3")
+    settings.SEARCH_COVERAGE_PATH = os.path.join(workdir, "search_coverage.sqlite3")
+    settings.METRICS_TEXTFILE_DIR = workdir
+
+    SatelliteProviderConfiguration.objects.get_or_create(
+        SATProviderName=PROVIDER_PEPS, defaults={"Username": "benchmark", "Password": "benchmark"}
+    )
+
+    from SatProductCurator.services.gateway_pool import get_gateway
+    from SatProductCurator.services.sentinel_tile_service import SentinelTileService
+
+    service = SentinelTileService()
+    aoi = Polygon(AOI, srid=4326)
+    start_date, end_date = datetime.date(2024, 6, 30), datetime.date(2024, 7, 31)
+
+    try:
+        # search_by_polygon / search_by_polygon_iter / update_to_database
+        features_by_size = {}
+        for size in args.sizes:
+            provider.total_results = size
+            results.append(
+                measure(
+                    "search_by_polygon",
+                    size,
+                    args.repeat,
+                    lambda: (
+                        len(
+                            service.search_by_polygon(
+                                PRODUCT_SENTINEL2, start_date, end_date, aoi, use_cache=False
+                            )["features"]
+                        ),
+                        0,
+                    ),
+                )
+            )
+
+            def search_all():
+                features_by_size[size] = list(
+                    service.search_by_polygon_iter(
+                        PRODUCT_SENTINEL2, start_date, end_date, aoi, use_cache=False
+                    )
+                )
+                return len(features_by_size[size]), 0
+
+            results.append(measure("search_by_polygon_iter", size, args.repeat, search_all))
+
+            def clear_tiles():
+                SatelliteImageTile.objects.all().delete()
+
+            results.append(
+                measure(
+                    "update_to_database",
+                    size,
+                    args.repeat,
+                    lambda _: (
+                        len(
+                            service.update_to_database(
+                                {"features": features_by_size[size]},
+                                PRODUCT_SENTINEL2,
+                                str(uuid.uuid4()),
+                            )
+                        ),
+                        0,
+                    ),
+                    setup=clear_tiles,
+                )
+            )
+
+        # Building EOProducts: temp-file deserialize vs in-memory
+        tiles = list(SatelliteImageTile.objects.all()[: max(args.sizes)])
+        dag = get_gateway(service.config)
+
+        def deserialize_through_file():
+            for tile in tiles:
+                with tempfile.NamedTemporaryFile(mode="w+", delete=False) as temp_file:
+                    json.dump({"type": "FeatureCollection", "features": [tile.eodag_data]}, temp_file)
+                dag.deserialize(temp_file.name)
+                os.remove(temp_file.name)
+            return len(tiles), 0
+
+        results.append(measure("deserialize_temp_file", len(tiles), args.repeat, deserialize_through_file))
+        results.append(
+            measure(
+                "build_products",
+                len(tiles),
+                args.repeat,
+                lambda: (len(service.build_products(tiles)), 0),
+            )
+        )
+
+        # download, sequential vs concurrent, through the resumable path
+        settings.RESUMABLE_DOWNLOADS = True
+        download_tiles = tiles[: args.download_count]
+
+        def reset_downloads():
+            shutil.rmtree(os.path.join(workdir, "downloads"))
+            os.makedirs(os.path.join(workdir, "downloads"))
+
+        download_bytes = len(provider.product_bytes) * len(download_tiles)
+        results.append(
+            measure(
+                "download",
+                len(download_tiles),
+                args.repeat,
+                lambda _: (sum(service.download(tile, None) for tile in download_tiles), download_bytes),
+                setup=reset_downloads,
+            )
+        )
+        results.append(
+            measure(
+                "download_many",
+                len(download_tiles),
+                args.repeat,
+                lambda _: (
+                    sum(
+                        error is None
+                        for error in service.download_many(
+                            [(tile, None) for tile in download_tiles]
+                        ).values()
+                    ),
+                    download_bytes,
+                ),
+                setup=reset_downloads,
+            )
+        )
+
+        # Claim-based work queue, draining the same backlog with 1..N processes
+        results.extend(measure_work_queue(args, start_date))
+
+        # Stored tile lookups
+        results.append(measure_stored_tile_lookup(service, args, aoi, start_date, end_date))
+
+        # Raster stages at each size
+        for raster_size in args.raster_sizes:
+            results.extend(run_raster_benchmarks(service, args, workdir, raster_size))
+
+        # Logging overhead per call
+        results.extend(measure_logging(args, workdir))
+    finally:
+        provider.stop()
+
+    return results
+
+
+def create_synthetic_tiles(count: int, start_date) -> None:
+    """Replace the stored tiles with count random tiles over the region."""
+    import random
+
+    from django.contrib.gis.geos import Polygon
+
+    from SatProductCurator.models import SatelliteImageTile
+    from SatProductCurator.models.constants import PRODUCT_SENTINEL2
+
+    SatelliteImageTile.objects.all().delete()
+    rng = random.Random(0)
+    batch = []
+    for i in range(count):
+        lon, lat = rng.uniform(40, 70), rng.uniform(10, 35)
+        tile_date = start_date + datetime.timedelta(days=rng.randrange(365))
+        batch.append(
+            SatelliteImageTile(
+                Product=PRODUCT_SENTINEL2,
+                tile_id=f"SYNTHETIC_{i:08d}",
+                date=tile_date,
+                boundary=Polygon.from_bbox((lon, lat, lon + 1, lat + 1)),
+                to_be_downloaded=True,
+                eodag_data={"properties": {"cloudCover": rng.uniform(0, 100)}},
+                New_Collection_ID=str(uuid.uuid4()),
+            )
+        )
+        if len(batch) == 10000:
+            SatelliteImageTile.objects.bulk_create(batch)
+            batch = []
+    SatelliteImageTile.objects.bulk_create(batch)
+
+
+def measure_stored_tile_lookup(service, args, aoi, start_date, end_date) -> dict:
+    from django.db import connection
+
+    from SatProductCurator.models import SatelliteImageTile
+    from SatProductCurator.models.constants import PRODUCT_SENTINEL2
+
+    create_synthetic_tiles(args.lookup_tiles, start_date)
+    # Fresh planner statistics, as autovacuum would have on the real table
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {SatelliteImageTile._meta.db_table}")
+
+    return measure(
+        "find_stored_tiles",
+        args.lookup_tiles,
+        args.repeat,
+        lambda: (
+            service.find_stored_tiles(
+                PRODUCT_SENTINEL2, aoi, start_date, end_date, max_cloud_cover=30
+            ).count(),
+            0,
+        ),
+    )
+
+
+def _drain_download_queue(work_seconds: float, processed) -> None:
+    from django.db import connections
+
+    from SatProductCurator.models import SatelliteImageTile
+    from SatProductCurator.services.work_queue import download_queue
+
+    # The forked worker must not share the parent's database connection
+    connections.close_all()
+
+    def process(tile):
+        time.sleep(work_seconds)
+        SatelliteImageTile.objects.filter(pk=tile.pk).update(is_downloaded=True)
+
+    count = download_queue().drain(process, batch_size=4)
+    with processed.get_lock():
+        processed.value += count
+    connections.close_all()
+
+
+def measure_work_queue(args, start_date) -> list:
+    import multiprocessing
+
+    from django.db import connections
+
+    results = []
+    context = multiprocessing.get_context("fork")
+    for workers in args.queue_workers:
+
+        def reset_backlog():
+            create_synthetic_tiles(args.queue_items, start_date)
+            connections.close_all()
+
+        def drain(_):
+            processed = context.Value("i", 0)
+            processes = [
+                context.Process(target=_drain_download_queue, args=(args.queue_work_seconds, processed))
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            return processed.value, 0
+
+        result = measure("work_queue_drain", workers, args.repeat, drain, setup=reset_backlog)
+        # Each item must have been processed successfully exactly once
+        result["duplicates"] = result["items"] - args.queue_items
+        results.append(result)
+    return results
+
+
+def run_raster_benchmarks(service, args, workdir: str, raster_size: int) -> list:
+    from django.contrib.gis.geos import Polygon
+
+    from SatProductCurator.models import SatelliteImageTile
+    from SatProductCurator.models.constants import PRODUCT_SENTINEL2
+    from SatProductCurator.services.cog_generator import band_sources, generate_product_cogs
+    from SatProductCurator.services.raster_clipper import clip_raster, clip_raster_batch
+    from SatProductCurator.services.scratch_staging import ScratchArea
+
+    results = []
+    band_dir = os.path.join(workdir, f"bands_{raster_size}")
+    if not os.path.isdir(band_dir):
+        write_synthetic_bands(band_dir, raster_size)
+    band_bytes = sum(entry.stat().st_size for entry in os.scandir(band_dir))
+
+    # Every run works on a fresh copy so the band manifest is built from a cold scan
+    def fresh_extracted_tile():
+        extracted_path = os.path.join(workdir, "extracted")
+        shutil.rmtree(extracted_path, ignore_errors=True)
+        shutil.copytree(band_dir, extracted_path)
+        return SatelliteImageTile(Product=PRODUCT_SENTINEL2, extracted_path=extracted_path)
+
+    results.append(
+        measure(
+            "fetch_target_images",
+            raster_size,
+            args.repeat,
+            lambda tile: (len(service.fetch_target_images(tile, None)), 0),
+            setup=fresh_extracted_tile,
+        )
+    )
+
+    nas_dir = args.nas_dir or os.path.join(workdir, "nas")
+    os.makedirs(nas_dir, exist_ok=True)
+    nas_bands = os.path.join(nas_dir, f"bands_{raster_size}")
+    if not os.path.isdir(nas_bands):
+        shutil.copytree(band_dir, nas_bands)
+    target_images = band_sources(nas_bands)
+
+    def cog_run(scratch):
+        def run(output_dir):
+            cog_results = generate_product_cogs(target_images, output_dir=output_dir, scratch=scratch)
+            return sum(result["Success"] for result in cog_results), band_bytes
+
+        return run
+
+    def fresh_output_dir():
+        output_dir = os.path.join(nas_dir, "cogs")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+        return output_dir
+
+    results.append(measure("cog_direct", raster_size, args.repeat, cog_run(None), setup=fresh_output_dir))
+    scratch = ScratchArea(os.path.join(workdir, "scratch"))
+    results.append(measure("cog_staged", raster_size, args.repeat, cog_run(scratch), setup=fresh_output_dir))
+
+    # Clip the B04 COG to its central half, then to its four quadrants at once
+    cog_dir = os.path.join(nas_dir, "cogs")
+    source = os.path.join(cog_dir, next(name for name in os.listdir(cog_dir) if "_B04" in name))
+    extent = raster_size * 10
+    min_x, max_y = SYNTHETIC_ORIGIN
+    min_y = max_y - extent
+    center = Polygon.from_bbox(
+        (min_x + extent / 4, min_y + extent / 4, min_x + 3 * extent / 4, min_y + 3 * extent / 4)
+    )
+    center.srid = 32640
+    results.append(
+        measure(
+            "clip_raster",
+            raster_size,
+            args.repeat,
+            lambda: (1, clip_raster(source, os.path.join(workdir, "clip.tif"), center)["BytesWritten"]),
+        )
+    )
+
+    quadrants = []
+    for i, (x, y) in enumerate([(0, 0), (0.5, 0), (0, 0.5), (0.5, 0.5)]):
+        quadrant = Polygon.from_bbox(
+            (
+                min_x + x * extent,
+                min_y + y * extent,
+                min_x + (x + 0.5) * extent,
+                min_y + (y + 0.5) * extent,
+            )
+        )
+        quadrant.srid = 32640
+        quadrants.append((os.path.join(workdir, f"clip_{i}.tif"), quadrant))
+    results.append(
+        measure(
+            "clip_raster_batch_4",
+            raster_size,
+            args.repeat,
+            lambda: (
+                len(quadrants),
+                sum(stats.get("BytesWritten") or 0 for stats in clip_raster_batch(source, quadrants)),
+            ),
+        )
+    )
+    return results
+
+
+def measure_logging(args, workdir: str) -> list:
+    from SatProductCurator.services.async_logging import flush_async_logging, install_async_logging
+
+    results = []
+    calls = 20000
+    for name, asynchronous in (("logging_sync", False), ("logging_async", True)):
+        logger = logging.getLogger(f"benchmark.{name}")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        handler = logging.FileHandler(os.path.join(workdir, f"{name}.log"))
+        handler.setFormatter(logging.Formatter("[%(levelname)s] [%(asctime)s] %(message)s"))
+        logger.addHandler(handler)
+        if asynchronous:
+            install_async_logging([logger.name])
+
+        def log_calls():
+            for i in range(calls):
+                logger.debug('{"worker": "SatDownloadWorker", "msg": "Downloading tile %s."}', i)
+            return calls, 0
+
+        result = measure(name, calls, args.repeat, log_calls)
+        result["seconds_per_call"] = result["median_seconds"] / calls
+        results.append(result)
+    flush_async_logging()
+    return results
+
+
+IMPORT_TIME_CODE = """
+import json, sys, time
+import django
+django.setup()
+start = time.perf_counter()
+import SatProductCurator.services.sentinel_tile_service
+seconds = time.perf_counter() - start
+heavy = [name for name in ("eodag", "rasterio", "numpy", "shapely", "geojson") if name in sys.modules]
+print(json.dumps({"seconds": seconds, "heavy_modules": heavy}))
+"""
+
+
+def measure_import_time(args) -> dict:
+    """Import the service in fresh interpreters, the fixed cost every mapped task pays."""
+    seconds = []
+    heavy_modules = []
+    for _ in range(args.repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_TIME_CODE], capture_output=True, text=True, check=True
+        ).stdout
+        measurement = json.loads(output.strip().splitlines()[-1])
+        seconds.append(measurement["seconds"])
+        heavy_modules = measurement["heavy_modules"]
+
+    median = statistics.median(seconds)
+    print(f"{'import_sentinel_tile_service':<32} median={median:.4f}s heavy={heavy_modules}")
+    return {
+        "name": "import_sentinel_tile_service",
+        "size": 1,
+        "repeat": args.repeat,
+        "seconds": seconds,
+        "median_seconds": median,
+        "budget_seconds": args.import_budget,
+        "heavy_modules": heavy_modules,
+    }
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    """Return the benchmarks whose median regressed beyond tolerance."""
+    with open(baseline_path) as baseline_file:
+        baseline = {
+            (result["name"], str(result["size"])): result
+            for result in json.load(baseline_file)["results"]
+        }
+
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["name"], str(result["size"])))
+        if previous and result["median_seconds"] > previous["median_seconds"] * (1 + tolerance):
+            regressions.append(
+                {
+                    "name": result["name"],
+                    "size": result["size"],
+                    "baseline_median_seconds": previous["median_seconds"],
+                    "median_seconds": result["median_seconds"],
+                }
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="previous results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sizes", type=lambda value: [int(v) for v in value.split(",")], default=[20, 200, 1000])
+    parser.add_argument("--raster-sizes", type=lambda value: [int(v) for v in value.split(",")], default=[1098, 5490])
+    parser.add_argument("--download-count", type=int, default=8)
+    parser.add_argument("--lookup-tiles", type=int, default=1000000)
+    parser.add_argument(
+        "--lookup-budget", type=float, default=0.1, help="seconds allowed for find_stored_tiles"
+    )
+    parser.add_argument("--queue-items", type=int, default=400)
+    parser.add_argument(
+        "--queue-workers", type=lambda value: [int(v) for v in value.split(",")], default=[1, 2, 4, 8]
+    )
+    parser.add_argument("--queue-work-seconds", type=float, default=0.02)
+    parser.add_argument(
+        "--import-budget", type=float, default=0.5, help="seconds allowed to import the tile service"
+    )
+    parser.add_argument("--nas-dir", help="mounted NAS stand-in for the direct vs staged COG comparison")
+    args = parser.parse_args()
+
+    import django
+
+    django.setup()
+    from django.db import connection
+
+    import_result = measure_import_time(args)
+
+    workdir = tempfile.mkdtemp(prefix="sat-benchmark-")
+    test_database = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = [import_result] + run_benchmarks(args, workdir)
+    finally:
+        connection.creation.destroy_test_db(test_database, verbosity=0)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        commit = None
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": commit,
+            "host": platform.node(),
+            "python": sys.version,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    report["regressions"] = compare(results, args.baseline, args.tolerance) if args.baseline else []
+    budgets = {
+        "import_sentinel_tile_service": args.import_budget,
+        "find_stored_tiles": args.lookup_budget,
+    }
+    for result in results:
+        budget = budgets.get(result["name"])
+        if budget is not None and result["median_seconds"] > budget:
+            report["regressions"].append(
+                {
+                    "name": result["name"],
+                    "size": result["size"],
+                    "baseline_median_seconds": budget,
+                    "median_seconds": result["median_seconds"],
+                }
+            )
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if report.get("regressions"):
+        for regression in report["regressions"]:
+            print(
+                f"REGRESSION {regression['name']} size={regression['size']}: "
+                f"{regression['baseline_median_seconds']:.4f}s -> {regression['median_seconds']:.4f}s"
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""COG generation engine for the bands of a satellite product.
+
+Bands are converted in-process with rasterio, in a process pool. The host
+CPU budget is split across the concurrent conversions instead of every
+conversion asking GDAL for ALL_CPUS, and each band reports its own timing
+and failure so one bad band doesn't fail the whole product.
+
+The budget is host-wide: every product conversion on the host, whichever
+worker process runs it, draws its cores from the same pool of CPU tokens,
+so parallel tasks don't each claim all the cores.
+"""
+import fcntl
+import os
+import tempfile
+import time
+import traceback
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import List, Optional
+
+from SatProductCurator.services.scratch_staging import ScratchArea
+
+COG_CREATION_OPTIONS = {
+    "PREDICTOR": "2",
+    "BIGTIFF": "YES",
+    "BLOCKSIZE": "128",
+}
+
+VSIZIP_PREFIX = "/vsizip/"
+
+# Sentinel-2 JP2 bands are tiled 1024x1024. The COG driver reads the source
+# a block row at a time, so a cache holding a full row of decoded tiles
+# (~24 MB for a 10980 px, 16 bit band) decodes each tile only once.
+DEFAULT_GDAL_CACHE_MB = 64
+
+
+class CpuTokens:
+    """Host-wide pool of CPU tokens shared by the processes converting bands.
+
+    Each token is a lock file under directory and is held with flock, so
+    the kernel gives the tokens of a process that dies back to the pool."""
+
+    def __init__(self, directory: Optional[str] = None, total: Optional[int] = None) -> None:
+        self.directory = directory or os.environ.get(
+            "COG_CPU_TOKEN_DIR", os.path.join(tempfile.gettempdir(), "sat_cog_cpu_tokens")
+        )
+        self.total = total or int(os.environ.get("COG_CPU_BUDGET", os.cpu_count() or 1))
+
+    @contextmanager
+    def acquire(self, wanted: int, poll_seconds: float = 0.5):
+        """Hold up to wanted tokens, waiting until at least one is free.
+        Yields the number of tokens held."""
+        os.makedirs(self.directory, exist_ok=True)
+        held = []
+        try:
+            while True:
+                for index in range(self.total):
+                    if len(held) >= wanted:
+                        break
+                    token = open(os.path.join(self.directory, f"cpu-{index}.lock"), "a")
+                    try:
+                        fcntl.flock(token, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        token.close()
+                        continue
+                    held.append(token)
+                if held:
+                    break
+                time.sleep(poll_seconds)
+            yield len(held)
+        finally:
+            for token in held:
+                token.close()
+
+
+def cog_path_for(input_file: str, output_dir: Optional[str] = None) -> str:
+    """<name>.jp2 -> <name>_cog.tif, next to the input unless output_dir is given.
+    Bands read from a zip default to a folder named after the zip."""
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    if output_dir is None:
+        if input_file.startswith(VSIZIP_PREFIX):
+            zip_path = _split_vsizip(input_file)[0]
+            output_dir = os.path.splitext(zip_path)[0]
+            os.makedirs(output_dir, exist_ok=True)
+        else:
+            output_dir = os.path.dirname(input_file)
+    return os.path.join(output_dir, f"{base_name}_cog.tif")
+
+
+def _split_vsizip(path: str):
+    """/vsizip/<zip>/<member> -> (<zip>, <member>)"""
+    zip_path, member = path[len(VSIZIP_PREFIX):].split(".zip/", 1)
+    return f"{zip_path}.zip", member
+
+
+def band_name_for(file_name: str) -> str:
+    """T39RZH_20240701T064629_B01.jp2 -> B01"""
+    return os.path.splitext(os.path.basename(file_name))[0].split("_")[-1]
+
+
+def band_sources(product_path: str) -> List[dict]:
+    """List the band JP2s of a product as {"Path", "BandName"}.
+
+    product_path is either a downloaded SAFE zip, whose bands are read in
+    place through /vsizip/ without extracting, or an already extracted folder."""
+    if zipfile.is_zipfile(product_path):
+        with zipfile.ZipFile(product_path) as archive:
+            members = [
+                member
+                for member in archive.namelist()
+                if "/IMG_DATA/" in member and member.lower().endswith(".jp2")
+            ]
+        return [
+            {
+                "Path": f"{VSIZIP_PREFIX}{product_path}/{member}",
+                "BandName": band_name_for(member),
+            }
+            for member in sorted(members)
+        ]
+
+    return [
+        {"Path": entry.path, "BandName": band_name_for(entry.name)}
+        for entry in sorted(os.scandir(product_path), key=lambda entry: entry.name)
+        if entry.is_file() and entry.name.lower().endswith(".jp2")
+    ]
+
+
+def _source_size(input_file: str) -> Optional[int]:
+    if input_file.startswith(VSIZIP_PREFIX):
+        zip_path, member = _split_vsizip(input_file)
+        with zipfile.ZipFile(zip_path) as archive:
+            return archive.getinfo(member).compress_size
+    if os.path.exists(input_file):
+        return os.path.getsize(input_file)
+    return None
+
+
+def convert_to_cog(
+    input_file: str,
+    output_file: str,
+    creation_options: Optional[dict] = None,
+    gdal_cache_mb: Optional[int] = None,
+    num_threads: int = 1,
+) -> dict:
+    """Convert one raster to COG in-process with rasterio.
+
+    The COG driver reads the source directly through GDAL's block cache,
+    sized by gdal_cache_mb, so no decoded copy of the band is written to
+    disk and the JP2 is never held in memory whole.
+    Returns the source size (the compressed member size for /vsizip/ paths),
+    the bytes written and the seconds spent."""
+    # Imported here so listing bands doesn't load GDAL in the worker process
+    import rasterio
+    import rasterio.shutil
+
+    options = dict(COG_CREATION_OPTIONS, **(creation_options or {}))
+    options["NUM_THREADS"] = str(num_threads)
+
+    env = {
+        "GDAL_NUM_THREADS": str(num_threads),
+        "GDAL_CACHEMAX": gdal_cache_mb or DEFAULT_GDAL_CACHE_MB,
+    }
+
+    stats = {
+        "Path": input_file,
+        "CogPath": output_file,
+        "SourceBytes": _source_size(input_file),
+        "BytesWritten": None,
+        "TotalSeconds": None,
+    }
+    start_time = time.time()
+
+    with rasterio.Env(**env):
+        rasterio.shutil.copy(input_file, output_file, driver="COG", **options)
+
+    stats["BytesWritten"] = os.path.getsize(output_file)
+    stats["TotalSeconds"] = time.time() - start_time
+    return stats
+
+
+def _convert_band(
+    target_image: dict, output_file: str, num_threads: int, gdal_cache_mb: Optional[int]
+) -> dict:
+    result = {
+        "BandName": target_image["BandName"],
+        "Path": target_image["Path"],
+        "CogPath": output_file,
+        "Success": False,
+        "Seconds": None,
+        "Stats": None,
+        "Error": None,
+    }
+    try:
+        result["Stats"] = convert_to_cog(
+            target_image["Path"],
+            output_file,
+            gdal_cache_mb=gdal_cache_mb,
+            num_threads=num_threads,
+        )
+        result["Seconds"] = result["Stats"]["TotalSeconds"]
+        result["Success"] = True
+    except Exception as e:
+        result["Error"] = f"{e} and {traceback.format_exc()}"
+    return result
+
+
+def _stage_source(scratch: ScratchArea, input_file: str):
+    """Stage input_file, returning the path to read and the staged file to release."""
+    if input_file.startswith(VSIZIP_PREFIX):
+        zip_path, member = _split_vsizip(input_file)
+        staged = scratch.stage_in(zip_path)
+        return f"{VSIZIP_PREFIX}{staged}/{member}", staged
+    staged = scratch.stage_in(input_file)
+    return staged, staged
+
+
+def generate_product_cogs(
+    target_images: List[dict],
+    output_dir: Optional[str] = None,
+    cpu_budget: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    gdal_cache_mb: Optional[int] = None,
+    scratch: Optional[ScratchArea] = None,
+    cpu_tokens: Optional[CpuTokens] = None,
+) -> List[dict]:
+    """Convert every band of a product to COG in parallel.
+
+    target_images has the shape returned by fetch_target_images
+    ({"Path", "BandName"}). cpu_budget is the total number of cores the
+    product may use, split evenly between the concurrent band conversions.
+    Without it the product takes up to one core per band from the host-wide
+    cpu_tokens pool, waiting for at least one, and holds them until done.
+    With a scratch area, inputs are staged to local disk, converted there
+    and the COGs moved to their final folder afterwards.
+    Returns one result dict per band with its COG path, seconds and error."""
+    if not target_images:
+        return []
+
+    if cpu_budget:
+        return _generate_product_cogs(
+            target_images, output_dir, cpu_budget, max_workers, gdal_cache_mb, scratch
+        )
+
+    cpu_tokens = cpu_tokens or CpuTokens()
+    with cpu_tokens.acquire(min(len(target_images), cpu_tokens.total)) as cpu_budget:
+        return _generate_product_cogs(
+            target_images, output_dir, cpu_budget, max_workers, gdal_cache_mb, scratch
+        )
+
+
+def _generate_product_cogs(
+    target_images: List[dict],
+    output_dir: Optional[str],
+    cpu_budget: int,
+    max_workers: Optional[int],
+    gdal_cache_mb: Optional[int],
+    scratch: Optional[ScratchArea],
+) -> List[dict]:
+    max_workers = max_workers or min(len(target_images), cpu_budget)
+    threads_per_band = max(1, cpu_budget // max_workers)
+
+    jobs = []
+    staged_inputs = []
+    results = [None] * len(target_images)
+    try:
+        for target_image in target_images:
+            cog_path = cog_path_for(target_image["Path"], output_dir)
+            if scratch:
+                source_path, staged = _stage_source(scratch, target_image["Path"])
+                staged_inputs.append(staged)
+                source = dict(target_image, Path=source_path)
+                work_path = scratch.output_path(os.path.basename(cog_path))
+                jobs.append((target_image, cog_path, source, work_path))
+            else:
+                jobs.append((target_image, cog_path, target_image, cog_path))
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    _convert_band, source, work_path, threads_per_band, gdal_cache_mb
+                ): i
+                for i, (_, _, source, work_path) in enumerate(jobs)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+    finally:
+        # Staged inputs are pinned against eviction until converted
+        for staged in staged_inputs:
+            scratch.release(staged)
+
+    if scratch:
+        for (target_image, cog_path, _, work_path), result in zip(jobs, results):
+            result["Path"] = target_image["Path"]
+            result["CogPath"] = cog_path
+            try:
+                if result["Success"]:
+                    scratch.stage_out(work_path, cog_path)
+                elif os.path.exists(work_path):
+                    os.remove(work_path)
+            except Exception as e:
+                result["Success"] = False
+                result["Error"] = f"{e} and {traceback.format_exc()}"
+
+    return results
@@ -0,0 +1,2 @@
+# test_search.py is a management command kept for manual searches, not a test module
+collect_ignore = ["test_search.py"]
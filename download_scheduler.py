@@ -0,0 +1,150 @@
+"""Concurrent download scheduler for Sentinel image tiles.
+
+Each provider gets its own bounded thread pool so a single worker can keep
+several transfers in flight without exceeding the provider's limits. Work
+is ordered largest product first, which keeps the pools busy until the end
+instead of finishing on one long transfer.
+
+eodag plugins keep per-transfer state, so every download thread uses its
+own gateway slot instead of sharing the process's default gateway.
+"""
+import logging
+import threading
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+
+from IngestionEngine.models import SourceData
+from IngestionEngine.workers._base_logger import Logger
+from SatProductCurator.models import SatelliteImageTile
+from SatProductCurator.services.gateway_pool import acquire_slot, release_slot
+
+log = Logger("SentinelDownloadScheduler").get_logger()
+
+
+def product_size(eodag_data: dict) -> int:
+    """Return the product size in bytes advertised by the provider, 0 if unknown."""
+    properties = eodag_data.get("properties", {})
+    size = (
+        properties.get("services", {}).get("download", {}).get("size")
+        or properties.get("resourceSize")
+        or 0
+    )
+    return int(size)
+
+
+def product_provider(eodag_data: dict) -> str:
+    return eodag_data.get("properties", {}).get("eodag_provider", "")
+
+
+class DownloadScheduler:
+    def __init__(self, service, max_concurrent_per_provider: Optional[int] = None):
+        self.service = service
+        self.max_concurrent_per_provider = max_concurrent_per_provider or getattr(
+            settings, "MAX_CONCURRENT_DOWNLOADS_PER_PROVIDER", 4
+        )
+        self._thread_slot = threading.local()
+
+    def _bind_slot(self, provider: str, slots: List[int]) -> None:
+        """Executor initializer: give the new thread a gateway slot of its own."""
+        slot = acquire_slot(provider)
+        self._thread_slot.value = slot
+        slots.append(slot)
+
+    def download_all(
+        self, items: Iterable[Tuple[SatelliteImageTile, SourceData]]
+    ) -> Dict[int, Optional[BaseException]]:
+        """Download every (tile, source data) pair.
+
+        Returns a mapping of tile pk to None on success or the raised exception,
+        so the caller can record failures per tile."""
+        by_provider: Dict[str, List[Tuple[SatelliteImageTile, SourceData]]] = defaultdict(list)
+        for sat_image_tile, source_data in items:
+            provider = (
+                product_provider(sat_image_tile.eodag_data) or self.service.config.SATProviderName
+            )
+            by_provider[provider].append(
+                (sat_image_tile, source_data)
+            )
+
+        # Build the EOProducts of the whole batch in one call
+        all_tiles = [tile for provider_items in by_provider.values() for tile, _ in provider_items]
+        products = dict(
+            zip(
+                (tile.pk for tile in all_tiles),
+                self.service.build_products(all_tiles) if all_tiles else [],
+            )
+        )
+
+        results: Dict[int, Optional[BaseException]] = {}
+        executors = []
+        slots: Dict[str, List[int]] = defaultdict(list)
+        futures = {}
+        try:
+            for provider, provider_items in by_provider.items():
+                # Largest products first so the small ones fill the gaps at the end
+                provider_items.sort(
+                    key=lambda item: product_size(item[0].eodag_data), reverse=True
+                )
+                executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrent_per_provider,
+                    thread_name_prefix=f"download-{provider}",
+                    initializer=self._bind_slot,
+                    initargs=(provider, slots[provider]),
+                )
+                executors.append(executor)
+                for sat_image_tile, source_data in provider_items:
+                    future = executor.submit(
+                        self._download_one,
+                        sat_image_tile,
+                        source_data,
+                        products[sat_image_tile.pk],
+                    )
+                    futures[future] = sat_image_tile
+
+            for future in as_completed(futures):
+                sat_image_tile = futures[future]
+                results[sat_image_tile.pk] = future.exception()
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
+            for provider, provider_slots in slots.items():
+                for slot in provider_slots:
+                    release_slot(provider, slot)
+
+        log(
+            f"Download scheduler finished: {sum(e is None for e in results.values())} "
+            f"downloaded, {sum(e is not None for e in results.values())} failed.",
+            level=logging.INFO,
+            MethodName=self.download_all.__qualname__,
+            StatusCode=200,
+        )
+        return results
+
+    def _download_one(
+        self, sat_image_tile: SatelliteImageTile, source_data: SourceData, product
+    ):
+        try:
+            return self.service.download(
+                sat_image_tile,
+                source_data,
+                product=product,
+                gateway_slot=self._thread_slot.value,
+            )
+        except Exception as e:
+            log(
+                f"Error while downloading satellite image tile: {e} and {traceback.format_exc()}",
+                sat_image_tile=sat_image_tile,
+                source_data=source_data,
+                level=logging.ERROR,
+                MethodName=self._download_one.__qualname__,
+                StatusCode=500,
+            )
+            raise
+        finally:
+            # Threads get their own DB connection, release it once the transfer is done
+            connection.close()
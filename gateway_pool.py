@@ -0,0 +1,144 @@
+"""Process-wide pool of EODataAccessGateway instances.
+
+Building an EODataAccessGateway parses providers.yml, the plugin provider
+configs and the user eodag.yml, which costs several hundred milliseconds
+before any network work starts. Gateways are therefore built once per
+worker process and reused, so plugin instances and their auth sessions
+are shared by every search and download running in that process.
+
+eodag itself is only imported, and its logging set up, when the first
+gateway is built. Provider configurations are cached per process too, for
+PROVIDER_CONFIG_TTL seconds so edits made from another process (the admin,
+another worker) are picked up, and dropped at once when the
+SatelliteProviderConfiguration row changes in this process.
+"""
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from SatProductCurator.models import SatelliteProviderConfiguration
+
+if TYPE_CHECKING:
+    from eodag import EODataAccessGateway
+
+# (provider, username, password, slot) -> gateway
+_gateways: Dict[Tuple[str, str, str, int], "EODataAccessGateway"] = {}
+# provider -> (configuration row, monotonic time it was read)
+_configs: Dict[str, Tuple[SatelliteProviderConfiguration, float]] = {}
+_lock = threading.Lock()
+_eodag_logging_ready = False
+# provider -> gateway slots held by threads of this process. Slot 0 is the
+# shared default gateway and never handed out.
+_slots_in_use: Dict[str, Set[int]] = defaultdict(set)
+
+
+def get_provider_config(provider: str) -> SatelliteProviderConfiguration:
+    """Return the provider's configuration, queried at most once per
+    PROVIDER_CONFIG_TTL seconds per process."""
+    cached = _configs.get(provider)
+    now = time.monotonic()
+    if cached is not None and now - cached[1] < getattr(settings, "PROVIDER_CONFIG_TTL", 60):
+        return cached[0]
+
+    config = SatelliteProviderConfiguration.objects.get(SATProviderName=provider)
+    with _lock:
+        _configs[provider] = (config, now)
+    return config
+
+
+def _pool_key(
+    config: SatelliteProviderConfiguration, slot: int
+) -> Tuple[str, str, str, int]:
+    return (config.SATProviderName, config.Username or "", config.Password or "", slot)
+
+
+def get_gateway(
+    config: SatelliteProviderConfiguration, slot: int = 0
+) -> "EODataAccessGateway":
+    """Return the shared gateway for a provider configuration.
+
+    The gateway is keyed by provider and credentials, so editing the
+    SatelliteProviderConfiguration row makes the next call build a fresh one.
+    eodag search plugins keep per-query state, so callers running searches in
+    parallel pass a distinct slot per thread to get separate gateways."""
+    key = _pool_key(config, slot)
+
+    with _lock:
+        dag = _gateways.get(key)
+        if dag is not None:
+            return dag
+
+        # Credentials changed for this provider, drop the outdated gateways
+        for stale_key in [
+            stale_key
+            for stale_key in _gateways
+            if stale_key[0] == key[0] and stale_key[1:3] != key[1:3]
+        ]:
+            del _gateways[stale_key]
+
+        # eodag reads provider credentials from the environment on startup
+        prefix = f"EODAG__{config.SATProviderName.upper()}__AUTH__CREDENTIALS__"
+        os.environ[f"{prefix}USERNAME"] = config.Username or ""
+        os.environ[f"{prefix}PASSWORD"] = config.Password or ""
+
+        from eodag import EODataAccessGateway, setup_logging
+
+        global _eodag_logging_ready
+        if not _eodag_logging_ready:
+            setup_logging(verbose=3)
+            _eodag_logging_ready = True
+
+        dag = EODataAccessGateway()
+        dag.set_preferred_provider(config.SATProviderName)
+        _gateways[key] = dag
+        return dag
+
+
+def acquire_slot(provider: str) -> int:
+    """Reserve the lowest gateway slot of the provider no other thread of
+    this process holds. Give it back with release_slot."""
+    with _lock:
+        in_use = _slots_in_use[provider]
+        slot = next(slot for slot in itertools.count(1) if slot not in in_use)
+        in_use.add(slot)
+        return slot
+
+
+def release_slot(provider: str, slot: int) -> None:
+    with _lock:
+        _slots_in_use[provider].discard(slot)
+
+
+@contextmanager
+def reserved_gateway(config: SatelliteProviderConfiguration):
+    """A gateway of the provider that no other thread uses while the block runs."""
+    slot = acquire_slot(config.SATProviderName)
+    try:
+        yield get_gateway(config, slot=slot)
+    finally:
+        release_slot(config.SATProviderName, slot)
+
+
+def invalidate(provider: Optional[str] = None) -> None:
+    """Forget pooled gateways and cached configurations for a provider, or all
+    of them if none given."""
+    with _lock:
+        for key in [key for key in _gateways if provider is None or key[0] == provider]:
+            del _gateways[key]
+        for name in [name for name in _configs if provider is None or name == provider]:
+            del _configs[name]
+
+
+def _on_configuration_changed(sender, instance, **kwargs):
+    invalidate(instance.SATProviderName)
+
+
+post_save.connect(_on_configuration_changed, sender=SatelliteProviderConfiguration)
+post_delete.connect(_on_configuration_changed, sender=SatelliteProviderConfiguration)
@@ -0,0 +1,255 @@
+"""Hedged search across several configured providers.
+
+The preferred provider is queried first. When it hasn't answered by its
+observed p95 latency, or fails, the same search is sent to the next
+provider, and so on. The answers received by the time the first one
+succeeds are merged, deduplicated by product name, preferring the earlier
+provider's feature. Per-provider latencies and errors are kept in SQLite so
+short-lived worker processes share them; they drive both the hedge delay and
+the timeout after which a provider is given up on.
+"""
+import json
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+from django.conf import settings
+
+from IngestionEngine.workers._base_logger import Logger
+from SatProductCurator.models import SatelliteProviderConfiguration
+from SatProductCurator.services.gateway_pool import get_provider_config, reserved_gateway
+
+log = Logger("HedgedSearch").get_logger()
+
+# Observations kept per provider
+LATENCY_WINDOW = 200
+# Below this many successes the defaults are used instead of the p95
+MIN_SAMPLES = 5
+DEFAULT_HEDGE_DELAY = 5.0
+MIN_TIMEOUT = 10.0
+MAX_TIMEOUT = 120.0
+TIMEOUT_MULTIPLIER = 3
+
+
+class ProviderStats:
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or getattr(
+            settings,
+            "PROVIDER_STATS_PATH",
+            os.path.join(tempfile.gettempdir(), "sat_provider_stats.sqlite3"),
+        )
+
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS provider_search (
+                    id INTEGER PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    seconds REAL NOT NULL,
+                    ok INTEGER NOT NULL,
+                    at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE INDEX IF NOT EXISTS provider_search_lookup
+                ON provider_search (provider, id)"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, provider: str, seconds: float, ok: bool) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO provider_search (provider, seconds, ok, at) VALUES (?, ?, ?, ?)",
+                (provider, seconds, int(ok), time.time()),
+            )
+            conn.execute(
+                """DELETE FROM provider_search WHERE provider = ? AND id NOT IN (
+                    SELECT id FROM provider_search WHERE provider = ?
+                    ORDER BY id DESC LIMIT ?
+                )""",
+                (provider, provider, LATENCY_WINDOW),
+            )
+
+    def summary(self, provider: str) -> dict:
+        """p95 latency of the successful searches, error rate and derived
+        hedge delay and timeout for a provider."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seconds, ok FROM provider_search WHERE provider = ?", (provider,)
+            ).fetchall()
+
+        latencies = sorted(seconds for seconds, ok in rows if ok)
+        p95 = None
+        if len(latencies) >= MIN_SAMPLES:
+            p95 = latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+
+        hedge_delay = p95 if p95 is not None else DEFAULT_HEDGE_DELAY
+        return {
+            "Provider": provider,
+            "Samples": len(rows),
+            "ErrorRate": (len(rows) - len(latencies)) / len(rows) if rows else 0.0,
+            "P95": p95,
+            "HedgeDelay": hedge_delay,
+            "Timeout": min(MAX_TIMEOUT, max(MIN_TIMEOUT, hedge_delay * TIMEOUT_MULTIPLIER)),
+        }
+
+
+def search_providers(primary: Optional[str] = None) -> List[SatelliteProviderConfiguration]:
+    """Configurations of the providers to search, in SEARCH_PROVIDERS order with
+    primary first. Defaults to primary alone."""
+    names = list(getattr(settings, "SEARCH_PROVIDERS", None) or [primary])
+    if primary in names:
+        names.remove(primary)
+        names.insert(0, primary)
+    configs = []
+    for name in names:
+        try:
+            configs.append(get_provider_config(name))
+        except SatelliteProviderConfiguration.DoesNotExist:
+            continue
+    return configs
+
+
+def product_name(feature: dict) -> str:
+    """Product name shared by every provider, e.g. S2B_MSIL1C_20240701T064629_..."""
+    properties = feature.get("properties", {})
+    return properties.get("title") or feature.get("id")
+
+
+def merge_features(feature_lists: List[List[dict]]) -> List[dict]:
+    """Concatenate the features, keeping the first one seen for each product."""
+    merged = {}
+    for features in feature_lists:
+        for feature in features:
+            merged.setdefault(product_name(feature), feature)
+    return list(merged.values())
+
+
+def eodag_search(
+    config: SatelliteProviderConfiguration, **search_kwargs
+) -> Tuple[List[dict], Optional[int]]:
+    """Search one provider through a pooled gateway reserved for this request,
+    returning the GeoJSON features and the provider's total count. A request
+    the hedged search gave up on keeps its gateway until it finishes, so it
+    never shares plugin state with a later search."""
+    import geojson
+
+    with reserved_gateway(config) as dag:
+        # raise_errors so timeouts are counted and hedged instead of
+        # coming back as an empty result
+        search_results, total_count = dag.search(raise_errors=True, **search_kwargs)
+    return json.loads(geojson.dumps(search_results))["features"], total_count
+
+
+class HedgedSearch:
+    def __init__(
+        self,
+        configs: List[SatelliteProviderConfiguration],
+        stats: Optional[ProviderStats] = None,
+        search_provider: Optional[Callable] = None,
+    ) -> None:
+        self.configs = configs
+        self.stats = stats or ProviderStats()
+        self.search_provider = search_provider or eodag_search
+
+    def _search_provider(
+        self, config: SatelliteProviderConfiguration, **search_kwargs
+    ) -> Tuple[List[dict], Optional[int]]:
+        start_time = time.perf_counter()
+        try:
+            answer = self.search_provider(config, **search_kwargs)
+        except Exception:
+            self.stats.record(config.SATProviderName, time.perf_counter() - start_time, False)
+            raise
+        self.stats.record(config.SATProviderName, time.perf_counter() - start_time, True)
+        return answer
+
+    def search(self, **search_kwargs) -> Tuple[dict, bool]:
+        """Run dag.search(**search_kwargs) hedged across the providers and return
+        the merged FeatureCollection, and whether every provider that answered
+        returned all its matches. Raises the last error if every provider fails."""
+        summaries = [self.stats.summary(config.SATProviderName) for config in self.configs]
+        in_flight = {}
+        answers = {}
+        last_error = None
+        next_provider = 0
+        deadlines = {}
+        # Not used as a context manager: requests given up on must not block the return
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self.configs)), thread_name_prefix="hedged-search"
+        )
+
+        while not answers:
+            if next_provider < len(self.configs):
+                config = self.configs[next_provider]
+                future = executor.submit(self._search_provider, config, **search_kwargs)
+                in_flight[future] = next_provider
+                deadlines[future] = time.monotonic() + summaries[next_provider]["Timeout"]
+                if next_provider:
+                    log(
+                        f"Hedging search to {config.SATProviderName}.",
+                        level=logging.INFO,
+                        MethodName=self.search.__qualname__,
+                        StatusCode=100,
+                    )
+                next_provider += 1
+            elif not in_flight:
+                break
+
+            # Wait up to the newest request's hedge delay before trying the next
+            # provider; once every provider is in flight, up to the first deadline
+            if next_provider < len(self.configs):
+                timeout = summaries[next_provider - 1]["HedgeDelay"]
+            else:
+                timeout = max(0.0, min(deadlines.values()) - time.monotonic())
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = in_flight.pop(future)
+                deadlines.pop(future)
+                try:
+                    answers[index] = future.result()
+                except Exception as e:
+                    last_error = e
+                    log(
+                        f"Search on {self.configs[index].SATProviderName} failed: {e}",
+                        level=logging.WARNING,
+                        MethodName=self.search.__qualname__,
+                        StatusCode=500,
+                    )
+
+            # Give up on requests past their adaptive timeout; their threads finish
+            # in the background and are still recorded in the stats
+            now = time.monotonic()
+            for future in [future for future, deadline in deadlines.items() if deadline <= now]:
+                index = in_flight.pop(future)
+                deadlines.pop(future)
+                last_error = TimeoutError(
+                    f"Search on {self.configs[index].SATProviderName} exceeded "
+                    f"{summaries[index]['Timeout']:.1f} seconds."
+                )
+
+        executor.shutdown(wait=False)
+        if not answers:
+            raise last_error or RuntimeError("No search provider configured.")
+
+        # Merge what has arrived, preferring the providers earlier in the order
+        features = merge_features([answers[index][0] for index in sorted(answers)])
+        complete = all(
+            total_count is not None and len(provider_features) >= total_count
+            for provider_features, total_count in answers.values()
+        )
+        return {"type": "FeatureCollection", "features": features}, complete
@@ -0,0 +1,187 @@
+"""Per-stage timing of the tile pipeline with Prometheus textfile export.
+
+Each stage (search, ingest, deserialize, download, extraction, target
+images, COG, clip) is recorded as a span with its duration, bytes and
+outcome, logged with the same context keys as the worker Logger and
+aggregated into histograms. Every worker process on the host merges its
+counts into one textfile that a node_exporter textfile collector or any
+local scraper can read.
+"""
+import atexit
+import fcntl
+import functools
+import inspect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from IngestionEngine.workers._base_logger import Logger
+
+log = Logger("PipelineMetrics").get_logger()
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Write the textfile at most this often; the remainder is flushed at exit
+EXPORT_INTERVAL = 15
+
+
+def _empty_metric() -> dict:
+    return {"buckets": [0] * len(DURATION_BUCKETS), "count": 0, "sum": 0.0, "bytes": 0}
+
+
+_lock = threading.Lock()
+_pending = defaultdict(_empty_metric)
+_last_export = 0.0
+
+
+class Span:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.bytes = 0
+        self.outcome = "success"
+
+
+@contextmanager
+def stage(name: str, **context):
+    """Time a pipeline stage. context takes the Logger keys (sat_image_tile,
+    source_data, MethodName); set span.bytes inside the block to record bytes."""
+    span = Span(name)
+    start_time = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span.outcome = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start_time
+        record(name, duration, span.bytes, span.outcome)
+        log(
+            f"Stage {name} finished with {span.outcome} in {duration:.3f} seconds, "
+            f"{span.bytes} bytes.",
+            level=logging.DEBUG,
+            StatusCode=200 if span.outcome == "success" else 500,
+            **context,
+        )
+
+
+def timed_stage(name: str, bytes_from=None):
+    """Decorate a service method so every call is recorded as a stage.
+
+    sat_image_tile and source_data arguments are passed on as log context.
+    bytes_from(result, arguments) returns the bytes processed by the call,
+    arguments being the bound call arguments by name."""
+
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            context = {
+                key: arguments[key]
+                for key in ("sat_image_tile", "source_data")
+                if arguments.get(key) is not None
+            }
+            with stage(name, MethodName=method.__qualname__, **context) as span:
+                result = method(*args, **kwargs)
+                if bytes_from is not None:
+                    span.bytes = bytes_from(result, arguments) or 0
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def record(
+    name: str, duration: float, bytes_processed: int = 0, outcome: str = "success"
+) -> None:
+    with _lock:
+        metric = _pending[(name, outcome)]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                metric["buckets"][i] += 1
+        metric["count"] += 1
+        metric["sum"] += duration
+        metric["bytes"] += bytes_processed
+
+    if time.time() - _last_export >= EXPORT_INTERVAL:
+        export()
+
+
+@atexit.register
+def export() -> None:
+    """Merge this process' pending counts into the host textfile."""
+    global _last_export
+
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_export = time.time()
+    if not pending:
+        return
+
+    metrics_dir = getattr(settings, "METRICS_TEXTFILE_DIR", tempfile.gettempdir())
+    state_path = os.path.join(metrics_dir, "sat_pipeline_metrics.json")
+
+    with open(f"{state_path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        state = {}
+        if os.path.exists(state_path):
+            with open(state_path) as state_file:
+                state = json.load(state_file)
+
+        for (name, outcome), metric in pending.items():
+            key = f"{name}|{outcome}"
+            merged = state.setdefault(key, _empty_metric())
+            merged["buckets"] = [a + b for a, b in zip(merged["buckets"], metric["buckets"])]
+            merged["count"] += metric["count"]
+            merged["sum"] += metric["sum"]
+            merged["bytes"] += metric["bytes"]
+
+        _atomic_write(state_path, json.dumps(state))
+        _atomic_write(os.path.join(metrics_dir, "sat_pipeline.prom"), _render(state))
+
+
+def _render(state: dict) -> str:
+    lines = [
+        "# HELP sat_pipeline_stage_duration_seconds Duration of tile pipeline stages.",
+        "# TYPE sat_pipeline_stage_duration_seconds histogram",
+    ]
+    for key in sorted(state):
+        name, outcome = key.split("|")
+        metric = state[key]
+        labels = f'stage="{name}",outcome="{outcome}"'
+        for bound, count in zip(DURATION_BUCKETS, metric["buckets"]):
+            lines.append(
+                f'sat_pipeline_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}'
+            )
+        lines.append(
+            f'sat_pipeline_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {metric["count"]}'
+        )
+        lines.append(f"sat_pipeline_stage_duration_seconds_sum{{{labels}}} {metric['sum']}")
+        lines.append(f"sat_pipeline_stage_duration_seconds_count{{{labels}}} {metric['count']}")
+
+    lines.append("# HELP sat_pipeline_stage_bytes_total Bytes processed by tile pipeline stages.")
+    lines.append("# TYPE sat_pipeline_stage_bytes_total counter")
+    for key in sorted(state):
+        name, outcome = key.split("|")
+        lines.append(
+            f'sat_pipeline_stage_bytes_total{{stage="{name}",outcome="{outcome}"}} {state[key]["bytes"]}'
+        )
+    return "\n".join(lines) + "\n"
+
+
+def _atomic_write(path: str, content: str) -> None:
+    partial_path = f"{path}.{os.getpid()}.tmp"
+    with open(partial_path, "w") as partial_file:
+        partial_file.write(content)
+    os.replace(partial_path, path)
@@ -0,0 +1,312 @@
+"""Content-addressed store for downloaded products and their derivatives.
+
+The same product found by several collection requests is downloaded,
+extracted and converted to COG once. Products are keyed by provider,
+provider product ID and checksum; each entry holds the downloaded zip, the
+extracted folder and the COG outputs, and each collection request that uses
+the entry links to it with a reference instead of a copy.
+
+References are empty files under refs/, one per collection request, so they
+can be added and dropped from any host sharing the store over NFS without a
+lock. A request takes its references when its search results are ingested,
+including tiles first found by another request, and drops them when it is
+deleted. Only entries nobody references are evicted, least recently used
+first.
+
+Workers keep reading the zip at eodag's download path, where a symlink to
+the stored product is left. Likewise the first stage to read a tile's
+extracted folder moves it into the entry and leaves a symlink behind, and
+tiles of other requests for the same product read that extraction.
+
+Each entry records its size in a file when something is written to it, so
+eviction reads one small file per entry instead of walking every tree.
+
+Layout:
+    <root>/<key[:2]>/<key>/product.zip
+                          /extracted/
+                          /cogs/
+                          /refs/<New_Collection_ID>
+                          /size
+"""
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from typing import List, Optional
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+
+from IngestionEngine.workers._base_logger import Logger
+from SatProductCurator.models import NewCollectionRequest, SatelliteImageTile
+from SatProductCurator.services.download_scheduler import product_provider
+
+log = Logger("ProductStore").get_logger()
+
+PRODUCT_FILE = "product.zip"
+EXTRACTED_FOLDER = "extracted"
+COG_FOLDER = "cogs"
+REFS_FOLDER = "refs"
+SIZE_FILE = "size"
+
+
+def product_key(eodag_data: dict) -> str:
+    """sha1 of provider, provider product ID and checksum."""
+    properties = eodag_data.get("properties", {})
+    product_id = (
+        properties.get("uid")
+        or properties.get("id")
+        or eodag_data.get("id")
+        or properties.get("title")
+    )
+    checksum = (
+        properties.get("services", {}).get("download", {}).get("checksum")
+        or properties.get("resourceChecksum")
+        or ""
+    )
+    return hashlib.sha1(
+        f"{product_provider(eodag_data)}:{product_id}:{checksum}".encode()
+    ).hexdigest()
+
+
+class ProductStore:
+    def __init__(self, root: str, quota_bytes: Optional[int] = None) -> None:
+        self.root = root
+        self.quota_bytes = quota_bytes
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def product_path(self, key: str) -> str:
+        return os.path.join(self.entry_path(key), PRODUCT_FILE)
+
+    def extracted_path(self, key: str) -> str:
+        return os.path.join(self.entry_path(key), EXTRACTED_FOLDER)
+
+    def cog_dir(self, key: str) -> str:
+        path = os.path.join(self.entry_path(key), COG_FOLDER)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def has_product(self, key: str) -> bool:
+        return os.path.isfile(self.product_path(key))
+
+    def has_extracted(self, key: str) -> bool:
+        return os.path.isdir(self.extracted_path(key))
+
+    def put_product(self, key: str, downloaded_path: str) -> str:
+        """Move a downloaded zip into the store. Concurrent puts of the same
+        product are safe, the last rename wins with identical content.
+        Raises when downloaded_path is a symlink, e.g. one left to an evicted
+        entry that the download went through."""
+        if os.path.islink(downloaded_path):
+            message = (
+                f"{downloaded_path} is a symlink to {os.readlink(downloaded_path)}, "
+                f"not a downloaded product."
+            )
+            log(
+                message,
+                level=logging.ERROR,
+                MethodName=self.put_product.__qualname__,
+                StatusCode=400,
+            )
+            raise Exception(message)
+
+        destination = self.product_path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        partial_path = f"{destination}.{uuid.uuid4().hex}.part"
+        try:
+            shutil.move(downloaded_path, partial_path)
+            os.replace(partial_path, destination)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        self.record_size(key)
+        return destination
+
+    def link_product(self, key: str, path: str) -> str:
+        """Point path at the stored product with a symlink, replacing any file there."""
+        return _replace_with_link(self.product_path(key), path)
+
+    def put_extracted(self, key: str, folder: str) -> str:
+        """Move an extracted product folder into the store and leave a symlink
+        to it at folder. When another worker stored the same extraction first,
+        the stored one is kept and folder is discarded. Returns the stored path."""
+        destination = self.extracted_path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if not os.path.isdir(destination):
+            partial_path = f"{destination}.{uuid.uuid4().hex}.part"
+            try:
+                shutil.move(folder, partial_path)
+                # Renaming onto a directory another worker already put fails
+                # instead of replacing it
+                os.rename(partial_path, destination)
+            except OSError:
+                if not os.path.isdir(destination):
+                    raise
+            finally:
+                shutil.rmtree(partial_path, ignore_errors=True)
+        shutil.rmtree(folder, ignore_errors=True)
+        _replace_with_link(destination, folder)
+        self.record_size(key)
+        return destination
+
+    def find_extracted(self, key: str, folder: Optional[str] = None) -> Optional[str]:
+        """The stored extraction of a product, None when there is none yet.
+
+        folder is the tile's own extracted folder: a real folder is moved into
+        the store, and a missing one is linked to the stored extraction."""
+        if folder and os.path.isdir(folder) and not os.path.islink(folder):
+            return self.put_extracted(key, folder)
+        if not self.has_extracted(key):
+            return None
+        if folder and not os.path.lexists(folder):
+            _replace_with_link(self.extracted_path(key), folder)
+        return self.extracted_path(key)
+
+    def record_size(self, key: str) -> int:
+        """Walk one entry and save its size for eviction. Called whenever
+        something is written to the entry."""
+        size = _tree_size(self.entry_path(key))
+        size_path = os.path.join(self.entry_path(key), SIZE_FILE)
+        partial_path = f"{size_path}.{uuid.uuid4().hex}.part"
+        try:
+            with open(partial_path, "w") as size_file:
+                size_file.write(str(size))
+            os.replace(partial_path, size_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return size
+
+    def add_ref(self, key: str, collection_id) -> None:
+        refs_dir = os.path.join(self.entry_path(key), REFS_FOLDER)
+        os.makedirs(refs_dir, exist_ok=True)
+        with open(os.path.join(refs_dir, str(collection_id)), "a"):
+            pass
+        # Touch the entry so eviction sees it as recently used
+        os.utime(self.entry_path(key))
+
+    def remove_ref(self, key: str, collection_id) -> None:
+        try:
+            os.remove(os.path.join(self.entry_path(key), REFS_FOLDER, str(collection_id)))
+        except FileNotFoundError:
+            pass
+
+    def release_collection(self, collection_id) -> int:
+        """Drop every reference held by a collection request. Returns how many."""
+        released = 0
+        if not os.path.isdir(self.root):
+            return released
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    os.remove(os.path.join(entry.path, REFS_FOLDER, str(collection_id)))
+                except FileNotFoundError:
+                    continue
+                released += 1
+        return released
+
+    def refs(self, key: str) -> List[str]:
+        try:
+            return os.listdir(os.path.join(self.entry_path(key), REFS_FOLDER))
+        except FileNotFoundError:
+            return []
+
+    def evict(self, bytes_needed: int = 0) -> int:
+        """Delete unreferenced entries, least recently used first, until
+        bytes_needed fits the quota. Returns the bytes freed."""
+        if not self.quota_bytes or not os.path.isdir(self.root):
+            return 0
+
+        entries = []
+        used = 0
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                size = self._entry_size(entry.name)
+                used += size
+                entries.append((entry.stat().st_mtime, entry.name, entry.path, size))
+
+        freed = 0
+        for _, key, path, size in sorted(entries):
+            if used + bytes_needed <= self.quota_bytes:
+                break
+            if self.refs(key):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            used -= size
+            freed += size
+            log(
+                f"Evicted unreferenced product {key} ({size} bytes) from the product store.",
+                level=logging.DEBUG,
+                MethodName=self.evict.__qualname__,
+                StatusCode=200,
+            )
+        return freed
+
+    def _entry_size(self, key: str) -> int:
+        try:
+            with open(os.path.join(self.entry_path(key), SIZE_FILE)) as size_file:
+                return int(size_file.read())
+        except (OSError, ValueError):
+            pass
+        # Entries written before sizes were recorded, or being evicted by another host
+        try:
+            return self.record_size(key)
+        except FileNotFoundError:
+            return 0
+
+
+def _replace_with_link(target: str, path: str) -> str:
+    """Put a symlink to target at path, replacing any file or link there."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = f"{path}.{uuid.uuid4().hex}.link"
+    os.symlink(os.path.abspath(target), partial_path)
+    try:
+        os.replace(partial_path, path)
+    finally:
+        if os.path.lexists(partial_path):
+            os.remove(partial_path)
+    return path
+
+
+def _tree_size(path: str) -> int:
+    size = 0
+    pending = [path]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                else:
+                    size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+
+def get_product_store() -> Optional[ProductStore]:
+    """The configured store, None when PRODUCT_STORE_DIR is not set."""
+    root = getattr(settings, "PRODUCT_STORE_DIR", None)
+    if not root:
+        return None
+    return ProductStore(root, quota_bytes=getattr(settings, "PRODUCT_STORE_QUOTA_BYTES", None))
+
+
+def _on_tile_deleted(sender, instance, **kwargs):
+    store = get_product_store()
+    if store is not None and instance.eodag_data:
+        store.remove_ref(product_key(instance.eodag_data), instance.New_Collection_ID)
+
+
+def _on_collection_request_deleted(sender, instance, **kwargs):
+    store = get_product_store()
+    if store is not None:
+        store.release_collection(instance.NewCollectionID)
+
+
+post_delete.connect(_on_tile_deleted, sender=SatelliteImageTile)
+post_delete.connect(_on_collection_request_deleted, sender=NewCollectionRequest)
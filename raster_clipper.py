@@ -0,0 +1,243 @@
+"""Windowed raster clipping for clip requests.
+
+Only the pixel window covering the AOI is read, block by block, and masked
+with the AOI shape directly, so peak memory is bounded by the block size
+rather than the size of the source raster. Several AOIs against the same
+source are clipped in one pass, sharing every block read between them.
+
+Each clip is written to a DEFLATE-compressed tiled GeoTIFF in staging_dir,
+next to its output by default, then converted to COG and removed, so no
+uncompressed copy lands in the system temp dir.
+"""
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import rasterio
+import rasterio.features
+import rasterio.windows
+from django.contrib.gis.geos import GEOSGeometry
+
+from SatProductCurator.services.cog_generator import convert_to_cog
+from SatProductCurator.services.pipeline_metrics import record, timed_stage
+
+CLIP_BLOCKSIZE = 256
+
+# Staging is read once by the COG copy, favour speed over ratio
+STAGING_COMPRESSION = {"compress": "DEFLATE", "ZLEVEL": 1}
+
+
+def aoi_shape(polygon: GEOSGeometry, crs) -> dict:
+    """Return the AOI as a GeoJSON-like mapping in the raster CRS."""
+    geometry = polygon.clone()
+    if geometry.srid is None:
+        geometry.srid = 4326
+    epsg = crs.to_epsg()
+    geometry.transform(epsg if epsg else crs.to_wkt())
+    return json.loads(geometry.geojson)
+
+
+@timed_stage("clip", bytes_from=lambda stats, arguments: stats.get("BytesWritten"))
+def clip_raster(
+    input_path: str,
+    output_path: str,
+    polygon: GEOSGeometry,
+    creation_options: Optional[dict] = None,
+    staging_dir: Optional[str] = None,
+) -> dict:
+    """Clip input_path to polygon and write the result as a COG.
+
+    Returns the clip window and the seconds spent reading/masking and writing."""
+    stats = clip_raster_batch(
+        input_path, [(output_path, polygon)], creation_options, staging_dir
+    )[0]
+    if stats["Error"]:
+        raise stats["Error"]
+    return stats
+
+
+def clip_raster_batch(
+    input_path: str,
+    clips: List[Tuple[str, GEOSGeometry]],
+    creation_options: Optional[dict] = None,
+    staging_dir: Optional[str] = None,
+) -> List[dict]:
+    """Clip one source raster to several AOIs in a single pass.
+
+    clips is a list of (output_path, polygon). The source is opened once and
+    every block of the union of the AOI windows is read once, then written
+    into each output it overlaps. Returns one stats dict per clip, in order,
+    with Error set instead of raising when a single clip fails."""
+    start_time = time.time()
+    results = [
+        {"Path": input_path, "ClipPath": output_path, "Window": None, "Error": None}
+        for output_path, _ in clips
+    ]
+    outputs = []
+
+    try:
+        with rasterio.open(input_path) as src:
+            nodata = src.nodata if src.nodata is not None else 0
+
+            for result, (output_path, polygon) in zip(results, clips):
+                try:
+                    shape = aoi_shape(polygon, src.crs)
+                    window = (
+                        rasterio.features.geometry_window(src, [shape])
+                        .round_offsets()
+                        .round_lengths()
+                    )
+                except Exception as e:
+                    result["Error"] = e
+                    continue
+                result["Window"] = window.flatten()
+
+                staging_file = os.path.join(
+                    staging_dir or os.path.dirname(os.path.abspath(output_path)),
+                    f".{os.path.basename(output_path)}.{uuid.uuid4().hex}.staging.tif",
+                )
+                profile = src.profile.copy()
+                profile.update(
+                    driver="GTiff",
+                    width=window.width,
+                    height=window.height,
+                    transform=src.window_transform(window),
+                    nodata=nodata,
+                    tiled=True,
+                    blockxsize=CLIP_BLOCKSIZE,
+                    blockysize=CLIP_BLOCKSIZE,
+                    BIGTIFF="IF_SAFER",
+                    **STAGING_COMPRESSION,
+                )
+                dst = rasterio.open(staging_file, "w", **profile)
+                outputs.append((result, shape, window, staging_file, dst))
+
+            if outputs:
+                union = rasterio.windows.union(*[output[2] for output in outputs])
+                for block in _blocks(union, CLIP_BLOCKSIZE * 4):
+                    overlapping = [
+                        output
+                        for output in outputs
+                        if rasterio.windows.intersect(block, output[2])
+                    ]
+                    if not overlapping:
+                        continue
+
+                    # One read of the block shared by every AOI that overlaps it
+                    data = src.read(window=block, boundless=True, fill_value=nodata)
+                    for result, shape, window, _, dst in overlapping:
+                        overlap = rasterio.windows.intersection(block, window)
+                        row_start = overlap.row_off - block.row_off
+                        col_start = overlap.col_off - block.col_off
+                        target = rasterio.windows.Window(
+                            overlap.col_off - window.col_off,
+                            overlap.row_off - window.row_off,
+                            overlap.width,
+                            overlap.height,
+                        )
+                        clipped = data[
+                            :,
+                            row_start : row_start + overlap.height,
+                            col_start : col_start + overlap.width,
+                        ].copy()
+                        outside = rasterio.features.geometry_mask(
+                            [shape],
+                            out_shape=(target.height, target.width),
+                            transform=dst.window_transform(target),
+                        )
+                        clipped[:, outside] = nodata
+                        dst.write(clipped, window=target)
+
+        read_seconds = time.time() - start_time
+        for result, _, _, staging_file, dst in outputs:
+            dst.close()
+            result["ReadSeconds"] = read_seconds
+            try:
+                cog_stats = convert_to_cog(
+                    staging_file,
+                    result["ClipPath"],
+                    creation_options=creation_options,
+                )
+                result["WriteSeconds"] = cog_stats["TotalSeconds"]
+                result["BytesWritten"] = cog_stats["BytesWritten"]
+            except Exception as e:
+                result["Error"] = e
+    finally:
+        for _, _, _, staging_file, dst in outputs:
+            if not dst.closed:
+                dst.close()
+            if os.path.exists(staging_file):
+                os.remove(staging_file)
+
+    for result in results:
+        result["TotalSeconds"] = time.time() - start_time
+    return results
+
+
+def _blocks(window, size: int):
+    """Split a window into size x size windows, row by row."""
+    col_off, row_off = int(window.col_off), int(window.row_off)
+    width, height = int(window.width), int(window.height)
+    for block_row in range(row_off, row_off + height, size):
+        for block_col in range(col_off, col_off + width, size):
+            yield rasterio.windows.Window(
+                block_col,
+                block_row,
+                min(size, col_off + width - block_col),
+                min(size, row_off + height - block_row),
+            )
+
+
+def group_clips_by_source(
+    items: List[Tuple[str, str, GEOSGeometry]]
+) -> Dict[str, List[Tuple[str, GEOSGeometry]]]:
+    """Group (source_path, output_path, polygon) items by source raster."""
+    grouped = defaultdict(list)
+    for source_path, output_path, polygon in items:
+        grouped[source_path].append((output_path, polygon))
+    return dict(grouped)
+
+
+def clip_sources(
+    grouped_clips: Dict[str, List[Tuple[str, GEOSGeometry]]],
+    creation_options: Optional[dict] = None,
+    max_workers: Optional[int] = None,
+    staging_dir: Optional[str] = None,
+) -> Dict[str, List[dict]]:
+    """Run clip_raster_batch for each source raster in a process pool.
+
+    Returns the per-clip stats keyed by source path; a source that can't be
+    opened reports its error on every one of its clips."""
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                clip_raster_batch, source_path, clips, creation_options, staging_dir
+            ): (
+                source_path,
+                clips,
+            )
+            for source_path, clips in grouped_clips.items()
+        }
+        for future in as_completed(futures):
+            source_path, clips = futures[future]
+            try:
+                results[source_path] = future.result()
+                for result in results[source_path]:
+                    # Workers exit without running atexit, so clip spans are recorded here
+                    record(
+                        "clip",
+                        result["TotalSeconds"],
+                        result.get("BytesWritten") or 0,
+                        "error" if result["Error"] else "success",
+                    )
+            except Exception as e:
+                results[source_path] = [
+                    {"Path": source_path, "ClipPath": output_path, "Window": None, "Error": e}
+                    for output_path, _ in clips
+                ]
+    return results
@@ -0,0 +1,84 @@
+"""Resumable, chunked HTTP download of provider products.
+
+Bytes are streamed into a ``<destination>.part`` file. When a transfer
+dies partway the next attempt continues from the size of the ``.part``
+file with an HTTP Range request instead of starting again from byte zero.
+The finished file is checked against the advertised size and checksum
+before it is renamed into place.
+"""
+import hashlib
+import os
+from typing import Callable, Optional
+
+import requests
+
+# A chunk cut short by a dropped connection is lost, so keep them small
+# enough that a resume only repeats a little of the transfer
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadVerificationError(Exception):
+    pass
+
+
+def download_resumable(
+    url: str,
+    destination: str,
+    auth=None,
+    expected_size: Optional[int] = None,
+    checksum: Optional[str] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+    timeout: int = 60,
+) -> str:
+    """Download url into destination, resuming from an existing .part file.
+
+    on_progress is called with the total number of bytes held in the .part
+    file after every chunk. Returns the destination path."""
+    part_path = f"{destination}.part"
+    received = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    if not expected_size or received < expected_size:
+        headers = {"Range": f"bytes={received}-"} if received else {}
+        with requests.get(
+            url, auth=auth, headers=headers, stream=True, timeout=timeout
+        ) as response:
+            if response.status_code == 416:
+                # Requested range starts at the end of the file, nothing left to fetch
+                pass
+            else:
+                response.raise_for_status()
+                if received and response.status_code != 206:
+                    # Server ignored the Range header and is sending the whole file
+                    received = 0
+
+                with open(part_path, "ab" if received else "wb") as part_file:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        part_file.write(chunk)
+                        received += len(chunk)
+                        if on_progress:
+                            on_progress(received)
+
+    _verify(part_path, received, expected_size, checksum)
+    os.replace(part_path, destination)
+    return destination
+
+
+def _verify(part_path: str, received: int, expected_size, checksum) -> None:
+    if expected_size and received != expected_size:
+        if received > expected_size:
+            os.remove(part_path)
+        raise DownloadVerificationError(
+            f"Downloaded size {received} does not match expected size {expected_size}"
+        )
+
+    if checksum:
+        md5 = hashlib.md5()
+        with open(part_path, "rb") as part_file:
+            for chunk in iter(lambda: part_file.read(CHUNK_SIZE), b""):
+                md5.update(chunk)
+        if md5.hexdigest().lower() != checksum.lower():
+            # A corrupt partial file can't be resumed, start over next time
+            os.remove(part_path)
+            raise DownloadVerificationError(
+                f"Checksum mismatch: got {md5.hexdigest()}, expected {checksum}"
+            )
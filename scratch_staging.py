@@ -0,0 +1,148 @@
+"""Local scratch staging for rasters that live on the NAS.
+
+GDAL does small random reads and tiled random writes, which are slow over
+NFS. Inputs are copied to local scratch with large sequential reads, the
+work is done there, and outputs go back to the NAS with one sequential
+write and an atomic rename. Staged inputs are kept for reuse and evicted
+least recently used first when the scratch quota would be exceeded.
+
+Several worker processes share the scratch area, so eviction runs under an
+flock on <root>/.lock, and every staged input is pinned with a shared flock
+on its .pin file from stage_in until release. Pinned inputs are in use by
+some process and are never evicted; a process that dies drops its pins.
+"""
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+def _sequential_copy(source: str, destination: str) -> None:
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+
+class ScratchArea:
+    def __init__(self, root: str, quota_bytes: Optional[int] = None) -> None:
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.inputs_dir = os.path.join(root, "inputs")
+        self.outputs_dir = os.path.join(root, "outputs")
+        os.makedirs(self.inputs_dir, exist_ok=True)
+        os.makedirs(self.outputs_dir, exist_ok=True)
+        # local path -> pin files held open by this process
+        self._pins: Dict[str, List] = {}
+        self._pins_lock = threading.Lock()
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the scratch area's cross-process lock."""
+        with open(os.path.join(self.root, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _pin(self, local_path: str) -> None:
+        pin_file = open(f"{local_path}.pin", "a")
+        fcntl.flock(pin_file, fcntl.LOCK_SH)
+        with self._pins_lock:
+            self._pins.setdefault(local_path, []).append(pin_file)
+
+    def release(self, local_path: str) -> None:
+        """Unpin an input returned by stage_in once it is no longer read."""
+        with self._pins_lock:
+            pin_files = self._pins.get(local_path)
+            if not pin_files:
+                return
+            pin_file = pin_files.pop()
+            if not pin_files:
+                del self._pins[local_path]
+        pin_file.close()
+
+    def stage_in(self, source: str) -> str:
+        """Return a local copy of source, copying it only if not already staged.
+        The copy stays pinned against eviction until release(local_path)."""
+        stat = os.stat(source)
+        key = hashlib.sha1(
+            f"{source}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+        ).hexdigest()
+        local_path = os.path.join(self.inputs_dir, f"{key}_{os.path.basename(source)}")
+
+        with self._exclusive():
+            self._pin(local_path)
+            if os.path.exists(local_path):
+                # Touch so LRU eviction sees it as recently used
+                os.utime(local_path)
+                return local_path
+            self._evict(stat.st_size)
+
+        partial_path = f"{local_path}.{uuid.uuid4().hex}.part"
+        try:
+            _sequential_copy(source, partial_path)
+            os.replace(partial_path, local_path)
+        except BaseException:
+            self.release(local_path)
+            raise
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return local_path
+
+    def output_path(self, file_name: str) -> str:
+        """Local path to write an output that will later be staged out."""
+        output_dir = os.path.join(self.outputs_dir, uuid.uuid4().hex)
+        os.makedirs(output_dir)
+        return os.path.join(output_dir, file_name)
+
+    def stage_out(self, local_path: str, destination: str) -> str:
+        """Move a local output to destination with a sequential write and an atomic rename."""
+        partial_path = f"{destination}.{uuid.uuid4().hex}.part"
+        try:
+            _sequential_copy(local_path, partial_path)
+            os.replace(partial_path, destination)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        os.remove(local_path)
+        local_dir = os.path.dirname(local_path)
+        if local_dir != self.outputs_dir and not os.listdir(local_dir):
+            os.rmdir(local_dir)
+        return destination
+
+    def ensure_space(self, bytes_needed: int) -> None:
+        """Evict the least recently used staged inputs that no process has
+        pinned until bytes_needed fits the quota."""
+        with self._exclusive():
+            self._evict(bytes_needed)
+
+    def _evict(self, bytes_needed: int) -> None:
+        if not self.quota_bytes:
+            return
+
+        entries = [
+            entry
+            for entry in os.scandir(self.inputs_dir)
+            if entry.is_file() and not entry.name.endswith((".part", ".pin"))
+        ]
+        used = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            if used + bytes_needed <= self.quota_bytes:
+                break
+            pin_path = f"{entry.path}.pin"
+            with open(pin_path, "a") as pin_file:
+                try:
+                    fcntl.flock(pin_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Pinned, a conversion is reading it
+                    continue
+                used -= entry.stat().st_size
+                os.remove(entry.path)
+                os.remove(pin_path)
@@ -0,0 +1,149 @@
+"""Persistent cache of provider search results.
+
+Entries are keyed by provider, productType, the date window and the AOI
+envelope, and stored in a SQLite file so every worker process on the host
+shares them. A query whose envelope falls inside a cached envelope for the
+same provider, product and dates is answered by filtering the cached
+features locally instead of querying the provider again.
+
+Only complete result sets are cached: every feature of the search, fetched
+without a provider error. A first page or an empty answer after a timeout
+would otherwise be served, and used to answer contained AOIs, for the whole
+TTL.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+
+# Envelopes are rounded to this many decimals (~10 cm) so that the same AOI
+# sent with float noise maps to the same entry.
+ENVELOPE_PRECISION = 6
+
+Extent = Tuple[float, float, float, float]
+
+
+def normalize_extent(extent: Extent) -> Extent:
+    return tuple(round(value, ENVELOPE_PRECISION) for value in extent)
+
+
+class SearchCache:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: Optional[int] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        self.path = path or getattr(
+            settings,
+            "SEARCH_CACHE_PATH",
+            os.path.join(tempfile.gettempdir(), "sat_search_cache.sqlite3"),
+        )
+        self.ttl = ttl if ttl is not None else getattr(settings, "SEARCH_CACHE_TTL", 6 * 3600)
+        self.max_entries = max_entries or getattr(settings, "SEARCH_CACHE_MAX_ENTRIES", 1000)
+
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS search_cache (
+                    id INTEGER PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    product_type TEXT NOT NULL,
+                    start TEXT NOT NULL,
+                    end TEXT NOT NULL,
+                    lonmin REAL NOT NULL,
+                    latmin REAL NOT NULL,
+                    lonmax REAL NOT NULL,
+                    latmax REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    results TEXT NOT NULL,
+                    complete INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (provider, product_type, start, end, lonmin, latmin, lonmax, latmax)
+                )"""
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(search_cache)")}
+            if "complete" not in columns:
+                # Entries written before completeness was tracked are never served
+                conn.execute(
+                    "ALTER TABLE search_cache ADD COLUMN complete INTEGER NOT NULL DEFAULT 0"
+                )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(
+        self, provider: str, product_type: str, start: str, end: str, extent: Extent
+    ) -> Optional[dict]:
+        """Return the cached FeatureCollection for the query, or None on a miss."""
+        extent = normalize_extent(extent)
+        now = time.time()
+
+        with self._connect() as conn:
+            # Smallest live envelope that contains the requested one
+            row = conn.execute(
+                """SELECT id, lonmin, latmin, lonmax, latmax, results FROM search_cache
+                WHERE provider = ? AND product_type = ? AND start = ? AND end = ?
+                AND lonmin <= ? AND latmin <= ? AND lonmax >= ? AND latmax >= ?
+                AND created_at >= ? AND complete = 1
+                ORDER BY (lonmax - lonmin) * (latmax - latmin) LIMIT 1""",
+                (provider, product_type, start, end, *extent, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE search_cache SET last_used = ? WHERE id = ?", (now, row[0]))
+
+        results = json.loads(row[5])
+        if tuple(row[1:5]) == extent:
+            return results
+
+        # The query AOI lies inside a cached one, keep only the features it touches
+        envelope = Polygon.from_bbox(extent)
+        results["features"] = [
+            feature
+            for feature in results["features"]
+            if envelope.intersects(GEOSGeometry(json.dumps(feature["geometry"])))
+        ]
+        return results
+
+    def put(
+        self,
+        provider: str,
+        product_type: str,
+        start: str,
+        end: str,
+        extent: Extent,
+        results: dict,
+    ) -> None:
+        """Cache a complete result set, see the module docstring."""
+        extent = normalize_extent(extent)
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO search_cache
+                (provider, product_type, start, end, lonmin, latmin, lonmax, latmax,
+                created_at, last_used, results, complete)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)""",
+                (provider, product_type, start, end, *extent, now, now, json.dumps(results)),
+            )
+
+            # Drop expired entries, then the least recently used ones above the limit
+            conn.execute("DELETE FROM search_cache WHERE created_at < ?", (now - self.ttl,))
+            conn.execute(
+                """DELETE FROM search_cache WHERE id NOT IN (
+                    SELECT id FROM search_cache ORDER BY last_used DESC LIMIT ?
+                )""",
+                (self.max_entries,),
+            )
@@ -0,0 +1,144 @@
+"""Index of the (provider, product, AOI, date window) ranges already searched.
+
+Windows are half-open ``[start, end)`` like the eodag search parameters. A
+recorded window covers a new query when its envelope contains the query
+envelope, so only the sub-intervals no such window covers need to reach
+the provider.
+
+Providers keep publishing products for recent acquisition dates, so the days
+within SEARCH_PUBLICATION_LAG_DAYS of today are never recorded as searched,
+and recorded windows expire after SEARCH_COVERAGE_TTL seconds so late
+reprocessings are eventually picked up.
+"""
+import datetime
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+from SatProductCurator.services.search_cache import Extent, normalize_extent
+
+
+class SearchCoverageIndex:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: Optional[int] = None,
+        publication_lag_days: Optional[int] = None,
+    ) -> None:
+        self.path = path or getattr(
+            settings,
+            "SEARCH_COVERAGE_PATH",
+            os.path.join(tempfile.gettempdir(), "sat_search_coverage.sqlite3"),
+        )
+        self.ttl = ttl if ttl is not None else getattr(
+            settings, "SEARCH_COVERAGE_TTL", 7 * 24 * 3600
+        )
+        self.publication_lag_days = (
+            publication_lag_days
+            if publication_lag_days is not None
+            else getattr(settings, "SEARCH_PUBLICATION_LAG_DAYS", 3)
+        )
+
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS search_coverage (
+                    id INTEGER PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    product_type TEXT NOT NULL,
+                    lonmin REAL NOT NULL,
+                    latmin REAL NOT NULL,
+                    lonmax REAL NOT NULL,
+                    latmax REAL NOT NULL,
+                    start TEXT NOT NULL,
+                    end TEXT NOT NULL,
+                    recorded_at REAL NOT NULL DEFAULT 0
+                )"""
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(search_coverage)")}
+            if "recorded_at" not in columns:
+                # Windows recorded before expiry was tracked count as expired
+                conn.execute(
+                    "ALTER TABLE search_coverage ADD COLUMN recorded_at REAL NOT NULL DEFAULT 0"
+                )
+            conn.execute(
+                """CREATE INDEX IF NOT EXISTS search_coverage_lookup
+                ON search_coverage (provider, product_type, start, end)"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(
+        self, provider: str, product_type: str, extent: Extent, start: date, end: date
+    ) -> None:
+        """Mark [start, end) as searched for the AOI envelope, up to the
+        publication lag horizon. Call it only once every result of the window
+        was fetched without error and ingested."""
+        end = min(end, datetime.date.today() - datetime.timedelta(days=self.publication_lag_days))
+        if end <= start:
+            return
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT INTO search_coverage
+                (provider, product_type, lonmin, latmin, lonmax, latmax, start, end, recorded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    provider,
+                    product_type,
+                    *normalize_extent(extent),
+                    start.isoformat(),
+                    end.isoformat(),
+                    now,
+                ),
+            )
+            conn.execute("DELETE FROM search_coverage WHERE recorded_at < ?", (now - self.ttl,))
+
+    def missing_intervals(
+        self, provider: str, product_type: str, extent: Extent, start: date, end: date
+    ) -> List[Tuple[date, date]]:
+        """Return the sub-intervals of [start, end) not yet searched for the AOI."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT start, end FROM search_coverage
+                WHERE provider = ? AND product_type = ?
+                AND lonmin <= ? AND latmin <= ? AND lonmax >= ? AND latmax >= ?
+                AND start < ? AND end > ? AND recorded_at >= ?
+                ORDER BY start""",
+                (
+                    provider,
+                    product_type,
+                    *normalize_extent(extent),
+                    end.isoformat(),
+                    start.isoformat(),
+                    time.time() - self.ttl,
+                ),
+            ).fetchall()
+
+        missing = []
+        cursor = start
+        for covered_start, covered_end in rows:
+            covered_start = datetime.date.fromisoformat(covered_start)
+            covered_end = datetime.date.fromisoformat(covered_end)
+            if covered_start > cursor:
+                missing.append((cursor, min(covered_start, end)))
+            cursor = max(cursor, covered_end)
+            if cursor >= end:
+                break
+
+        if cursor < end:
+            missing.append((cursor, end))
+        return missing
@@ -1,4 +1,3 @@
-from eodag import setup_logging
 from SatProductCurator.models.constants import (
     PRODUCT_LANDSAT8,
     PRODUCT_LANDSAT9,
@@ -7,66 +6,184 @@ from SatProductCurator.models.constants import (
     PRODUCT_SENTINEL3,
     PROVIDER_PEPS,
 )
-from SatProductCurator.models import SatelliteProviderConfiguration, SatelliteImageTile
-import tempfile
+from SatProductCurator.models import SatelliteImageTile
 import json
+import itertools
+import math
 import os
-import traceback
-from typing import List
-import rasterio
-from eodag import EODataAccessGateway
+from typing import TYPE_CHECKING, Dict, List
+from collections import defaultdict
+from functools import cached_property
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import datetime
 from datetime import date
-import geojson
-from django.contrib.gis.geos import Polygon
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, QuerySet
 from django.utils import timezone
-import uuid
 from django.conf import settings
 import logging
 from IngestionEngine.models import SourceData
 from IngestionEngine.workers._base_logger import Logger
+from SatProductCurator.services.async_logging import install_async_logging
+from SatProductCurator.services.band_index import band_manifest
+from SatProductCurator.services.cog_generator import (
+    CpuTokens,
+    band_sources,
+    cog_path_for,
+    generate_product_cogs,
+)
+from SatProductCurator.services.gateway_pool import (
+    get_gateway,
+    get_provider_config,
+    reserved_gateway,
+)
+from SatProductCurator.services.hedged_search import HedgedSearch, search_providers
+from SatProductCurator.services.download_scheduler import (
+    DownloadScheduler,
+    product_provider,
+    product_size,
+)
+from SatProductCurator.services.pipeline_metrics import timed_stage
+from SatProductCurator.services.product_store import get_product_store, product_key
+from SatProductCurator.services.resumable_download import download_resumable
+from SatProductCurator.services.search_cache import SearchCache
+from SatProductCurator.services.scratch_staging import ScratchArea
+from SatProductCurator.services.search_coverage import SearchCoverageIndex
+
+if TYPE_CHECKING:
+    from eodag.api.search_result import SearchResult
+
+# eodag, geojson, numpy, rasterio and shapely are imported in the methods that
+# use them: Airflow starts a process per mapped task, and most tasks only need
+# a few of them, so the module must stay cheap to import.
+
+_log_wrapper = Logger("SentinelImageTileService")
+log = _log_wrapper.get_logger()
+
+
+def _find_wrapped_logger():
+    """Return the stdlib logger the Logger wrapper writes to.
+
+    The wrapper renders its JSON message before calling it, so expensive DEBUG
+    messages are guarded with this logger's isEnabledFor. Falls back to the
+    root logger, which the wrapper's logger inherits its level from by default.
+    """
+    candidates = [getattr(log, "__self__", None)]
+    candidates += list(getattr(_log_wrapper, "__dict__", {}).values())
+    for candidate in candidates:
+        if isinstance(candidate, (logging.Logger, logging.LoggerAdapter)):
+            return candidate
+    return logging.getLogger()
 
-log = Logger("SentinelImageTileService").get_logger()
 
+_wrapped_logger = _find_wrapped_logger()
 
-setup_logging(verbose=3)
+# Products whose eodag properties map onto BusinessMeta
+METADATA_PRODUCTS = (PRODUCT_SENTINEL1, PRODUCT_SENTINEL2, PRODUCT_SENTINEL3)
+
+# BusinessMeta column -> eodag property
+METADATA_PROPERTIES = {
+    "Keywords": "keywords",
+    "CloudCover": "cloudCover",
+    "OrganizationName": "organisationName",
+    "ProcessingLevel": "processingLevel",
+    "Abstract": "abstract",
+    "SensorMode": "sensorMode",
+    "SensorType": "sensorType",
+    "ProductType": "productType",
+    "PlatformIdentifier": "platformSerialIdentifier",
+    "Identifier": "parentIdentifier",
+    "LicenseBasedConstraints": "license",
+    "PlatformName": "platform",
+    "Title": "title",
+    "Resolution": "resolution",
+}
+
+# Persist the resumable download progress on the tile every 64 MB
+RESUMABLE_PROGRESS_STEP = 64 * 1024 * 1024
+
+
+def _has_field(model, name: str) -> bool:
+    try:
+        model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+if getattr(settings, "ASYNC_LOGGING", False):
+    install_async_logging(
+        getattr(settings, "ASYNC_LOGGING_LOGGERS", ("",)),
+        sample_rates=getattr(settings, "ASYNC_LOGGING_SAMPLE_RATES", None),
+    )
 
 
 class SentinelTileService:
     def __init__(self) -> None:
-        config = SatelliteProviderConfiguration.objects.get(
-            SATProviderName=PROVIDER_PEPS
-        )
+        config = get_provider_config(PROVIDER_PEPS)
         print("---------Selected SATProviderName Configuration-----------")
         print("Config Object:", config)
         print("Provider Name:", config.SATProviderName)
         print("Username:", config.Username)
         print("Password:", config.Password)
-        os.environ["EODAG__PEPS__AUTH__CREDENTIALS__USERNAME"] = config.Username or ""
-        os.environ["EODAG__PEPS__AUTH__CREDENTIALS__PASSWORD"] = config.Password or ""
+        self.config = config
+
+    @cached_property
+    def search_cache(self) -> SearchCache:
+        return SearchCache()
 
+    @cached_property
+    def search_coverage(self) -> SearchCoverageIndex:
+        return SearchCoverageIndex()
+
+    @timed_stage("search")
     def search_by_polygon(
-        self, product: str, start_date: date, end_date: date, polygon: Polygon
+        self,
+        product: str,
+        start_date: date,
+        end_date: date,
+        polygon: Polygon,
+        use_cache: bool = True,
     ):
-        # Instantiate EODataAccessGateway object
-        dag = EODataAccessGateway()
+        """Search the configured providers for tiles within the polygon.
+
+        With several SEARCH_PROVIDERS the search is hedged across them and the
+        results merged; otherwise every page of the configured provider is
+        fetched through search_by_polygon_iter. Provider errors are raised.
+        Only complete result sets are cached."""
+        providers = search_providers(self.config.SATProviderName)
+        if len(providers) <= 1:
+            return {
+                "type": "FeatureCollection",
+                "features": list(
+                    self.search_by_polygon_iter(
+                        product, start_date, end_date, polygon, use_cache=use_cache
+                    )
+                ),
+            }
 
         # Determine the productType based on the input product
-        if product == PRODUCT_SENTINEL1:
-            productType = "S1_SAR_RAW"
-        elif product == PRODUCT_SENTINEL2:
-            productType = "S2_MSI_L1C"
-        elif product == PRODUCT_SENTINEL3:
-            productType = "S3_EFR"
-        else:
-            raise Exception(f"Unknown product: {product}")
+        productType = self.product_type(product)
 
         # min_x, min_y, max_x, max_y
         # Get the bounding box (extent) of the polygon
         extent = polygon.envelope.extent
 
-        # Perform search using EODataAccessGateway
-        search_results, total_count = dag.search(
+        # Answer from the search cache when the same or an enclosing AOI was searched
+        cache_key = (
+            "+".join(config.SATProviderName for config in providers),
+            productType,
+            str(start_date),
+            str(end_date),
+            extent,
+        )
+        if use_cache:
+            cached_results = self.search_cache.get(*cache_key)
+            if cached_results is not None:
+                return cached_results
+
+        results, complete = HedgedSearch(providers).search(
             productType=productType,
             start=str(start_date),
             end=str(end_date),
@@ -76,120 +193,415 @@ class SentinelTileService:
                 "lonmax": extent[2],
                 "latmax": extent[3],
             },
+            items_per_page=getattr(settings, "SEARCH_ITEMS_PER_PAGE", 100),
         )
+        if complete:
+            self.search_cache.put(*cache_key, results)
+        return results
+
+    def search_by_polygon_iter(
+        self,
+        product: str,
+        start_date: date,
+        end_date: date,
+        polygon: Polygon,
+        items_per_page: int = None,
+        max_concurrent_pages: int = None,
+        use_cache: bool = True,
+    ):
+        """Yield every GeoJSON feature matching the search, page by page.
 
-        # Convert search results to GeoJSON format
-        return json.loads(geojson.dumps(search_results))
+        The first page gives the total count, the remaining pages are then
+        fetched concurrently and their features yielded as each page arrives,
+        so memory stays bounded by max_concurrent_pages pages. A page that fails raises
+        instead of being skipped.
 
-    def filter_results(self, search_results):
-        pass
+        The search is answered from the search cache when the same or an
+        enclosing AOI was searched. Searches of up to SEARCH_CACHE_MAX_FEATURES
+        matches are kept while streamed and cached once every page arrived."""
+        items_per_page = items_per_page or getattr(settings, "SEARCH_ITEMS_PER_PAGE", 100)
+        max_concurrent_pages = max_concurrent_pages or getattr(
+            settings, "SEARCH_MAX_CONCURRENT_PAGES", 4
+        )
+        productType = self.product_type(product)
+        extent = polygon.envelope.extent
 
+        cache_key = (
+            self.config.SATProviderName,
+            productType,
+            str(start_date),
+            str(end_date),
+            extent,
+        )
+        if use_cache:
+            cached_results = self.search_cache.get(*cache_key)
+            if cached_results is not None:
+                yield from cached_results["features"]
+                return
+        search_kwargs = dict(
+            productType=productType,
+            start=str(start_date),
+            end=str(end_date),
+            geom={
+                "lonmin": extent[0],
+                "latmin": extent[1],
+                "lonmax": extent[2],
+                "latmax": extent[3],
+            },
+            items_per_page=items_per_page,
+        )
+
+        import geojson
+
+        def fetch_page(page):
+            # A gateway no other thread of the process is searching with
+            with reserved_gateway(self.config) as dag:
+                page_results, total_count = dag.search(
+                    page=page, raise_errors=True, **search_kwargs
+                )
+            return json.loads(geojson.dumps(page_results))["features"], total_count
+
+        features, total_count = fetch_page(1)
+        collected = None
+        if use_cache and total_count is not None and total_count <= getattr(
+            settings, "SEARCH_CACHE_MAX_FEATURES", 10000
+        ):
+            collected = list(features)
+        yield from features
+
+        pages = range(2, math.ceil((total_count or 0) / items_per_page) + 1)
+        if not pages:
+            if collected is not None:
+                self.search_cache.put(
+                    *cache_key, {"type": "FeatureCollection", "features": collected}
+                )
+            return
+
+        def fetch_page_features(page):
+            return fetch_page(page)[0]
+
+        executor = ThreadPoolExecutor(max_workers=max_concurrent_pages)
+        remaining_pages = iter(pages)
+        try:
+            # At most max_concurrent_pages pages are fetched or held ahead of the
+            # consumer; the next page is requested once one has been yielded
+            in_flight = {
+                executor.submit(fetch_page_features, page)
+                for page in itertools.islice(remaining_pages, max_concurrent_pages)
+            }
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page_features = future.result()
+                    if collected is not None:
+                        collected.extend(page_features)
+                    yield from page_features
+                    page = next(remaining_pages, None)
+                    if page is not None:
+                        in_flight.add(executor.submit(fetch_page_features, page))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        # Every page arrived without error
+        if collected is not None:
+            self.search_cache.put(*cache_key, {"type": "FeatureCollection", "features": collected})
+
+    @staticmethod
+    def product_type(product: str) -> str:
+        """Map a product constant to the eodag productType."""
+        if product == PRODUCT_SENTINEL1:
+            return "S1_SAR_RAW"
+        elif product == PRODUCT_SENTINEL2:
+            return "S2_MSI_L1C"
+        elif product == PRODUCT_SENTINEL3:
+            return "S3_EFR"
+        else:
+            raise Exception(f"Unknown product: {product}")
+
+    def search_by_polygon_incremental(
+        self,
+        product: str,
+        start_date: date,
+        end_date: date,
+        polygon: Polygon,
+        new_collection_id=None,
+    ):
+        """Search only the parts of the date window not searched before for this AOI.
+
+        The provider results for the missing sub-intervals, every page of them,
+        are merged with the tiles already stored for the whole window,
+        deduplicated by tile id. A sub-interval is recorded as searched only
+        once its results are stored, so with new_collection_id they are
+        ingested here first; without it nothing is recorded and the next call
+        searches the provider again."""
+        productType = self.product_type(product)
+        extent = polygon.envelope.extent
+
+        features = {}
+        for interval_start, interval_end in self.search_coverage.missing_intervals(
+            self.config.SATProviderName, productType, extent, start_date, end_date
+        ):
+            # Provider errors propagate, so a partial interval is never recorded
+            interval_features = list(
+                self.search_by_polygon_iter(product, interval_start, interval_end, polygon)
+            )
+            for feature in interval_features:
+                features[feature["id"]] = feature
+
+            if new_collection_id is not None:
+                self.update_to_database(interval_features, product, new_collection_id)
+                self.search_coverage.record(
+                    self.config.SATProviderName,
+                    productType,
+                    extent,
+                    interval_start,
+                    interval_end,
+                )
+
+        stored_tiles = self.find_stored_tiles(
+            product, polygon.envelope, start_date, end_date
+        ).values_list("tile_id", "eodag_data")
+        for tile_id, eodag_data in stored_tiles:
+            features.setdefault(tile_id, eodag_data)
+
+        log(
+            f"Incremental search for {productType} between {start_date} and {end_date} "
+            f"returned {len(features)} tiles.",
+            level=logging.DEBUG,
+            MethodName=self.search_by_polygon_incremental.__qualname__,
+            StatusCode=200,
+        )
+        return {"type": "FeatureCollection", "features": list(features.values())}
+
+    @staticmethod
+    def find_stored_tiles(
+        product: str,
+        polygon: Polygon,
+        start_date: date,
+        end_date: date,
+        max_cloud_cover: float = None,
+    ):
+        """Stored tiles of a product that intersect polygon in [start_date, end_date).
+
+        PostGIS ST_Intersects first applies the bbox overlap (&&) operator,
+        which the GiST index on boundary answers, and only runs the exact
+        test on the rows it returns."""
+        tiles = SatelliteImageTile.objects.filter(
+            Product=product,
+            date__gte=start_date,
+            date__lt=end_date,
+            boundary__intersects=polygon,
+        )
+
+        if max_cloud_cover is not None:
+            tiles = tiles.filter(
+                eodag_data__properties__cloudCover__lt=max_cloud_cover
+            )
+        return tiles
+
+    def filter_results(
+        self,
+        search_results: dict,
+        polygon: Polygon = None,
+        min_overlap_ratio: float = None,
+        coverage_tolerance: float = None,
+    ) -> dict:
+        """Keep the smallest set of tiles per acquisition date that covers the AOI.
+
+        Footprints are tested against the exact AOI polygon, not its envelope,
+        and tiles covering less than min_overlap_ratio of the AOI are dropped.
+        For each date tiles are then picked greedily by the AOI area they add;
+        among the tiles adding within coverage_tolerance of the best gain the
+        one with the lowest cloudCover wins, until the AOI is covered.
+        Without a polygon the results are returned unchanged."""
+        if polygon is None:
+            return search_results
+        if min_overlap_ratio is None:
+            min_overlap_ratio = getattr(settings, "MIN_TILE_OVERLAP_RATIO", 0.01)
+        if coverage_tolerance is None:
+            coverage_tolerance = getattr(settings, "TILE_COVERAGE_TOLERANCE", 0.1)
+
+        if polygon.srid is None:
+            polygon = polygon.clone()
+            polygon.srid = 4326
+        prepared_polygon = polygon.prepared
+        aoi_area = polygon.area
+
+        candidates_by_date = defaultdict(list)
+        for feature in search_results["features"]:
+            footprint = GEOSGeometry(json.dumps(feature["geometry"]), srid=4326)
+            if not prepared_polygon.intersects(footprint):
+                continue
+
+            coverage = polygon.intersection(footprint)
+            if coverage.area < min_overlap_ratio * aoi_area:
+                continue
+
+            acquisition_date = feature["properties"]["startTimeFromAscendingNode"][:10]
+            candidates_by_date[acquisition_date].append(
+                (feature, coverage, feature["properties"].get("cloudCover") or 0)
+            )
+
+        selected = []
+        for candidates in candidates_by_date.values():
+            uncovered = polygon
+            while candidates and uncovered.area > min_overlap_ratio * aoi_area:
+                gains = [
+                    (uncovered.intersection(coverage).area, cloud_cover, i)
+                    for i, (_, coverage, cloud_cover) in enumerate(candidates)
+                ]
+                best_gain = max(gain for gain, _, _ in gains)
+                if best_gain < min_overlap_ratio * aoi_area:
+                    break
+                # Comparable coverage, prefer the clearer tile
+                _, _, best = min(
+                    (gain for gain in gains if gain[0] >= best_gain * (1 - coverage_tolerance)),
+                    key=lambda gain: (gain[1], -gain[0]),
+                )
+
+                feature, coverage, _ = candidates.pop(best)
+                selected.append(feature)
+                uncovered = uncovered.difference(coverage)
+
+        log(
+            f"Selected {len(selected)} of {len(search_results['features'])} tiles covering the AOI.",
+            level=logging.DEBUG,
+            MethodName=self.filter_results.__qualname__,
+            StatusCode=200,
+        )
+        return {"type": "FeatureCollection", "features": selected}
+
+    @timed_stage("ingest")
     def update_to_database(
-        self, search_results: dict, product, new_collection_id
+        self, search_results, product, new_collection_id, batch_size=None
     ) -> List[SatelliteImageTile]:
-        # Initialize an empty list to store SatelliteImageTile objects
-        tiles = []
+        """Insert the searched tiles in batches and return the stored tiles.
 
-        # Iterate through each tile JSON object in the search results
-        for tile_json in search_results["features"]:
-            """try:
-                    # Attempt to retrieve the SatelliteImageTile from the database
-                    tile = SatelliteImageTile.objects.get(tile_id=tile_json["id"])
-                except SatelliteImageTile.DoesNotExist:
-                    # Extracting the date from the tile properties and formatting it
-
-                    tile_date = datetime.datetime.strptime(
-                        tile_json["properties"]["startTimeFromAscendingNode"],
-                        "%Y-%m-%dT%H:%M:%S.%fZ",
-                    ).date()
-
-                    # If the tile does not exist in the database, create a new SatelliteImageTile object
-                    tile = SatelliteImageTile(
-                        Product=product,
-                        tile_id=tile_json["id"],
-                        date=tile_date,
-                        boundary=Polygon(tile_json["geometry"]["coordinates"][0][0]),
-                        to_be_downloaded=settings.TO_BE_DOWNLOADED,
-                        eodag_data=tile_json,
-                        New_Collection_ID=new_collection_id,
-                    )
-                    tile.save()
-                    log(
-                        f"Mna New Collection id is: {new_collection_id}.",
-                        sat_image_tile=tile,
-                        level=logging.DEBUG,
-                    )
-                    log(
-                        f"Mna New Collection id from satellite tile table is: {tile.New_Collection_ID}.",
-                        sat_image_tile=tile,
-                        level=logging.DEBUG,
-                    )
+        search_results is either a GeoJSON FeatureCollection or an iterable of
+        features such as search_by_polygon_iter, consumed batch by batch.
+        Tiles whose tile_id is already stored are not inserted again but are
+        returned along with the new ones, in feed order, like the former
+        get-or-create loop did.
 
-                    log(
-                        "Sentinel image tile created Successfully.",
-                        sat_image_tile=tile,
-                        level=logging.DEBUG,
-                    )
-                # Add the SatelliteImageTile object to the list of tiles
-                tiles.append(tile)
+        Concurrent ingests of overlapping searches rely on the unique
+        constraint on tile_id (added by migration):
+            tile_id = models.CharField(..., unique=True)
+        so a row inserted by another worker between the lookup and the insert
+        is skipped by ignore_conflicts instead of duplicated.
 
-            return tiles"""
-            tile_date = datetime.datetime.strptime(
-                tile_json["properties"]["startTimeFromAscendingNode"],
-                "%Y-%m-%dT%H:%M:%S.%fZ",
-            ).date()
+        With the product store configured, every returned tile's product is
+        referenced for new_collection_id."""
+        batch_size = batch_size or getattr(settings, "TILE_INGEST_BATCH_SIZE", 500)
+        store = get_product_store()
+        if isinstance(search_results, dict):
+            search_results = search_results["features"]
 
-            type = tile_json["geometry"]["type"]
+        tiles = []
+        seen_tile_ids = set()
+        batch_number = 0
+        features = iter(search_results)
+        while True:
+            feature_batch = list(itertools.islice(features, batch_size))
+            if not feature_batch:
+                break
+            batch_number += 1
+
+            # Parse the whole batch first so that a bad geometry fails before any insert
+            parsed_tiles = {}
+            for tile_json in feature_batch:
+                if tile_json["id"] in seen_tile_ids:
+                    continue
+                seen_tile_ids.add(tile_json["id"])
 
-            if type == "MultiPolygon":
-                tile = SatelliteImageTile(
+                tile_date = datetime.datetime.strptime(
+                    tile_json["properties"]["startTimeFromAscendingNode"],
+                    "%Y-%m-%dT%H:%M:%S.%fZ",
+                ).date()
+
+                parsed_tiles[tile_json["id"]] = SatelliteImageTile(
                     Product=product,
                     tile_id=tile_json["id"],
                     date=tile_date,
-                    boundary=Polygon(tile_json["geometry"]["coordinates"][0][0]),
+                    boundary=self._feature_boundary(tile_json),
                     to_be_downloaded=settings.TO_BE_DOWNLOADED,
                     eodag_data=tile_json,
                     New_Collection_ID=new_collection_id,
                 )
-                tile.save()
-            elif type == "Polygon":
-                tile = SatelliteImageTile(
-                    Product=product,
-                    tile_id=tile_json["id"],
-                    date=tile_date,
-                    boundary=Polygon(tile_json["geometry"]["coordinates"][0]),
-                    to_be_downloaded=settings.TO_BE_DOWNLOADED,
-                    eodag_data=tile_json,
-                    New_Collection_ID=new_collection_id,
+
+            # Single set-based lookup for tiles that are already stored
+            existing_tiles = {
+                tile.tile_id: tile
+                for tile in SatelliteImageTile.objects.filter(tile_id__in=list(parsed_tiles))
+            }
+            new_tiles = [
+                tile for tile_id, tile in parsed_tiles.items() if tile_id not in existing_tiles
+            ]
+            SatelliteImageTile.objects.bulk_create(new_tiles, ignore_conflicts=True)
+
+            # ignore_conflicts leaves the pks unset, read the inserted rows back
+            # together with any a concurrent ingest won the race for
+            if new_tiles:
+                existing_tiles.update(
+                    (tile.tile_id, tile)
+                    for tile in SatelliteImageTile.objects.filter(
+                        tile_id__in=[tile.tile_id for tile in new_tiles]
+                    )
                 )
-                tile.save()
-            else:
-                raise ValueError("Unexpected geometry type and type is:", type)
+            batch_tiles = [
+                existing_tiles[tile_id] for tile_id in parsed_tiles if tile_id in existing_tiles
+            ]
+            tiles.extend(batch_tiles)
 
-            log(
-                f"Mna New Collection id is: {new_collection_id}.",
-                sat_image_tile=tile,
-                level=logging.DEBUG,
-                MethodName=self.update_to_database.__qualname__,StatusCode=500
-            )
-            log(
-                f"Mna New Collection id from satellite tile table is: {tile.New_Collection_ID}.",
-                sat_image_tile=tile,
-                level=logging.DEBUG,
-                MethodName=self.update_to_database.__qualname__,StatusCode=500
-            )
+            # A tile first found by another collection request keeps that
+            # request's New_Collection_ID, reference its stored product for
+            # this request too so it isn't evicted while either uses it
+            if store is not None:
+                for tile in batch_tiles:
+                    store.add_ref(product_key(tile.eodag_data), new_collection_id)
 
             log(
-                "Sentinel image tile created Successfully.",
-                sat_image_tile=tile,
+                f"Sentinel image tiles created Successfully for Mna New Collection id "
+                f"{new_collection_id}: {len(new_tiles)} created in batch "
+                f"{batch_number}, {len(parsed_tiles) - len(new_tiles)} already stored.",
                 level=logging.DEBUG,
-                MethodName=self.update_to_database.__qualname__,StatusCode=200
+                MethodName=self.update_to_database.__qualname__,
+                StatusCode=200,
             )
-            # Add the SatelliteImageTile object to the list of tiles
-            tiles.append(tile)
         return tiles
 
-    def download(self, sat_image_tile: SatelliteImageTile, source_data: SourceData):
+    @staticmethod
+    def _feature_boundary(tile_json: dict) -> Polygon:
+        """Build the tile boundary from an eodag GeoJSON feature."""
+        geometry_type = tile_json["geometry"]["type"]
+
+        if geometry_type == "MultiPolygon":
+            return Polygon(tile_json["geometry"]["coordinates"][0][0])
+        elif geometry_type == "Polygon":
+            return Polygon(tile_json["geometry"]["coordinates"][0])
+        else:
+            raise ValueError("Unexpected geometry type and type is:", geometry_type)
+
+    @timed_stage(
+        "download",
+        bytes_from=lambda result, arguments: product_size(
+            arguments["sat_image_tile"].eodag_data
+        ),
+    )
+    def download(
+        self,
+        sat_image_tile: SatelliteImageTile,
+        source_data: SourceData,
+        resumable: bool = None,
+        product=None,
+        gateway_slot: int = 0,
+    ):
+        """Download the tile's product. product may be passed when the
+        EOProduct was already built, e.g. by build_products for a batch.
+        Threads downloading concurrently pass their own gateway_slot.
+        With PRODUCT_STORE_DIR configured the download lands in the shared
+        product store, and a product already there is not downloaded again;
+        either way a symlink to the stored zip is left at eodag's download
+        path, where the workers read it."""
         log(
             "Downloading Sentinel image tile.",
             sat_image_tile=sat_image_tile,
@@ -198,56 +610,43 @@ class SentinelTileService:
             MethodName=self.download.__qualname__,StatusCode=100
         ),
 
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(mode="w+", delete=False) as temp_file:
-            log(
-                "Creating temporary file for JSON data.",
-                sat_image_tile=sat_image_tile,
-                source_data=source_data,
-                level=logging.DEBUG,
-                MethodName=self.download.__qualname__,StatusCode=100
-            ),
-
-            # Write JSON data to the temporary file
-            json.dump(
-                {"type": "FeatureCollection", "features": [sat_image_tile.eodag_data]},
-                temp_file,
-            )
+        # Reuse the process-wide EODataAccessGateway of the provider the tile
+        # was found on, which may be a hedged search's secondary provider
+        dag = get_gateway(self._provider_config(sat_image_tile), slot=gateway_slot)
 
-            # Remember the filename
-            temp_filename = temp_file.name
+        # Build the EOProduct straight from the stored eodag data
+        if product is None:
+            product = self.build_products([sat_image_tile])[0]
 
-            log(
-                f"Temporary file created: {temp_filename}",
-                sat_image_tile=sat_image_tile,
-                source_data=source_data,
-                level=logging.DEBUG,
-                MethodName=self.download.__qualname__,StatusCode=100
-            ),
-
-        # Initialize EODataAccessGateway instance
-        dag = EODataAccessGateway()
-
-        # Deserialize data from the temporary file using EODataAccessGateway
-        results = dag.deserialize(temp_filename)
-        log(
-            "Deserialize data from temporary file.",
-            sat_image_tile=sat_image_tile,
-            source_data=source_data,
-            level=logging.DEBUG,
-            MethodName=self.download.__qualname__,StatusCode=100
-        ),
-
-        # After the process, delete the temporary file
-        os.remove(temp_filename)
-
-        log(
-            f"Temporary file deleted: {temp_filename}",
-            sat_image_tile=sat_image_tile,
-            source_data=source_data,
-            level=logging.DEBUG,
-            MethodName=self.download.__qualname__,StatusCode=100
-        ),
+        # Link the tile to the shared product store and reuse a product another
+        # collection request already downloaded
+        store = get_product_store()
+        if store is not None:
+            key = product_key(sat_image_tile.eodag_data)
+            store.add_ref(key, sat_image_tile.New_Collection_ID)
+            if store.has_product(key):
+                # Consumers look for the zip where eodag would have written it
+                linked_path = store.link_product(key, self._download_path(dag, product))
+                log(
+                    f"Product found in the product store, reusing {store.product_path(key)} "
+                    f"linked at {linked_path}.",
+                    sat_image_tile=sat_image_tile,
+                    source_data=source_data,
+                    level=logging.INFO,
+                    MethodName=self.download.__qualname__,StatusCode=200
+                )
+                sat_image_tile.is_downloaded = True
+                sat_image_tile.dl_end_time = timezone.now()
+                SatelliteImageTile.objects.filter(pk=sat_image_tile.pk).update(
+                    is_downloaded=True,
+                    dl_end_time=sat_image_tile.dl_end_time,
+                )
+                return True
+            store.evict(product_size(sat_image_tile.eodag_data))
+            # A link left to an evicted entry would make eodag write through it
+            download_path = self._download_path(dag, product)
+            if os.path.islink(download_path):
+                os.remove(download_path)
 
         # Increment download attempts and save the download start time for the satellite image tile
         sat_image_tile.dl_attempts += 1
@@ -266,10 +665,23 @@ class SentinelTileService:
             level=logging.DEBUG,
             MethodName=self.download.__qualname__,StatusCode=100
         ),
-        sat_image_tile.save()
+        # Update only the download columns so concurrent downloads don't overwrite each other
+        SatelliteImageTile.objects.filter(pk=sat_image_tile.pk).update(
+            dl_attempts=F("dl_attempts") + 1,
+            dl_start_time=sat_image_tile.dl_start_time,
+        )
 
         # Download the satellite image data using EODataAccessGateway
-        dag.download(results[0], extract=False)
+        if resumable is None:
+            resumable = getattr(settings, "RESUMABLE_DOWNLOADS", False)
+        if resumable:
+            downloaded_path = self._download_resumable(dag, product, sat_image_tile)
+        else:
+            downloaded_path = dag.download(product, extract=False)
+        if store is not None:
+            # Leave a link behind where the zip was downloaded
+            store.put_product(key, downloaded_path)
+            store.link_product(key, downloaded_path)
 
         # Mark the satellite image tile as downloaded and save the download end time
         sat_image_tile.is_downloaded = True
@@ -288,7 +700,10 @@ class SentinelTileService:
             level=logging.DEBUG,
             MethodName=self.download.__qualname__,StatusCode=100
         ),
-        sat_image_tile.save()
+        SatelliteImageTile.objects.filter(pk=sat_image_tile.pk).update(
+            is_downloaded=True,
+            dl_end_time=sat_image_tile.dl_end_time,
+        )
 
         log(
             "Download completed successfully.",
@@ -300,6 +715,80 @@ class SentinelTileService:
 
         return True
 
+    @staticmethod
+    @timed_stage("deserialize")
+    def build_products(sat_image_tiles: List[SatelliteImageTile]) -> "SearchResult":
+        """Build the EOProducts of several tiles from their stored eodag_data in one call."""
+        from eodag.api.search_result import SearchResult
+
+        return SearchResult.from_geojson(
+            {
+                "type": "FeatureCollection",
+                "features": [tile.eodag_data for tile in sat_image_tiles],
+            }
+        )
+
+    def _provider_config(self, sat_image_tile: SatelliteImageTile):
+        """Configuration of the provider that returned the tile in the search."""
+        provider = product_provider(sat_image_tile.eodag_data)
+        if not provider or provider == self.config.SATProviderName:
+            return self.config
+        return get_provider_config(provider)
+
+    @staticmethod
+    def _download_path(dag, product) -> str:
+        """Where eodag downloads the product zip: <outputs_prefix>/<title>.zip."""
+        download_plugin = dag._plugins_manager.get_download_plugin(product)
+        return os.path.join(
+            download_plugin.config.outputs_prefix, f"{product.properties['title']}.zip"
+        )
+
+    def _download_resumable(self, dag, product, sat_image_tile: SatelliteImageTile):
+        """Download the product with byte-range resume into eodag's output folder,
+        recording the bytes received on the tile as the transfer progresses."""
+        auth = dag._plugins_manager.get_auth_plugin(product.provider).authenticate()
+        destination = self._download_path(dag, product)
+
+        download_service = (
+            sat_image_tile.eodag_data["properties"].get("services", {}).get("download", {})
+        )
+        url = download_service.get("url") or product.properties["downloadLink"]
+
+        # dl_bytes_received comes with a migration of its own, progress is
+        # only persisted once it has been applied
+        track_progress = _has_field(SatelliteImageTile, "dl_bytes_received")
+        last_recorded = 0
+
+        def record_progress(received):
+            nonlocal last_recorded
+            if track_progress and received - last_recorded >= RESUMABLE_PROGRESS_STEP:
+                SatelliteImageTile.objects.filter(pk=sat_image_tile.pk).update(
+                    dl_bytes_received=received
+                )
+                last_recorded = received
+
+        download_resumable(
+            url,
+            destination,
+            auth=auth,
+            expected_size=product_size(sat_image_tile.eodag_data),
+            checksum=download_service.get("checksum"),
+            on_progress=record_progress,
+        )
+
+        if track_progress:
+            sat_image_tile.dl_bytes_received = os.path.getsize(destination)
+            SatelliteImageTile.objects.filter(pk=sat_image_tile.pk).update(
+                dl_bytes_received=sat_image_tile.dl_bytes_received
+            )
+        return destination
+
+    def download_many(self, items, max_concurrent_per_provider=None):
+        """Download several (tile, source data) pairs concurrently.
+        Returns a mapping of tile pk to None or the exception raised for it."""
+        scheduler = DownloadScheduler(self, max_concurrent_per_provider)
+        return scheduler.download_all(items)
+
     def fetch_metadata(
         self, sat_image_tile: SatelliteImageTile, source_data: SourceData
     ):
@@ -321,7 +810,7 @@ class SentinelTileService:
             level=logging.DEBUG,
             MethodName=self.fetch_metadata.__qualname__,StatusCode=100
         )
-        if sat_image_tile.Product == PRODUCT_SENTINEL2:
+        if sat_image_tile.Product in METADATA_PRODUCTS:
             # Initialize an empty dictionary to store metadata
             metadata = {}
 
@@ -348,29 +837,17 @@ class SentinelTileService:
                     MethodName=self.fetch_metadata.__qualname__,StatusCode=100
                 )
 
-            metadata["Keywords"] = properties.get("keywords", None)
-            metadata["CloudCover"] = properties.get("cloudCover", None)
-            metadata["OrganizationName"] = properties.get("organisationName", None)
-            metadata["ProcessingLevel"] = properties.get("processingLevel", None)
-            metadata["Abstract"] = properties.get("abstract", None)
-            metadata["SensorMode"] = properties.get("sensorMode", None)
-            metadata["SensorType"] = properties.get("sensorType", None)
-            metadata["ProductType"] = properties.get("productType", None)
-            metadata["PlatformIdentifier"] = properties.get(
-                "platformSerialIdentifier", None
-            )
-            metadata["Identifier"] = properties.get("parentIdentifier", None)
-            metadata["LicenseBasedConstraints"] = properties.get("license", None)
-            metadata["PlatformName"] = properties.get("platform", None)
-            metadata["Title"] = properties.get("title", None)
-            metadata["Resolution"] = properties.get("resolution", None)
+            for column, property_name in METADATA_PROPERTIES.items():
+                metadata[column] = properties.get(property_name, None)
 
-            log(
-                f"Successfully fetched metadata for Sentinel tile image and metadata is: {metadata}",
-                sat_image_tile=sat_image_tile,
-                source_data=source_data,
-                level=logging.DEBUG,
-            )
+            # Only build the metadata dump when DEBUG records are actually written
+            if _wrapped_logger.isEnabledFor(logging.DEBUG):
+                log(
+                    f"Successfully fetched metadata for Sentinel tile image and metadata is: {metadata}",
+                    sat_image_tile=sat_image_tile,
+                    source_data=source_data,
+                    level=logging.DEBUG,
+                )
             # Return the fetched metadata
             return metadata
 
@@ -390,6 +867,80 @@ class SentinelTileService:
                 MethodName=self.fetch_metadata.__qualname__,StatusCode=500
             )
 
+    def fetch_metadata_batch(self, sat_image_tiles) -> Dict[str, list]:
+        """Fetch the BusinessMeta-shaped metadata of many tiles as columns.
+
+        sat_image_tiles is a queryset or a list of tiles. Returns a dict of
+        equally long lists: SatelliteImageTileID, Extent and one list per
+        metadata property. Extents are built in bulk with shapely."""
+        if isinstance(sat_image_tiles, QuerySet):
+            rows = list(sat_image_tiles.values_list("pk", "Product", "eodag_data"))
+        else:
+            rows = [(tile.pk, tile.Product, tile.eodag_data) for tile in sat_image_tiles]
+
+        unsupported = {product for _, product, _ in rows if product not in METADATA_PRODUCTS}
+        if unsupported:
+            raise Exception(f"No fetching logic found for fetching metadata {unsupported}")
+
+        columns = {"SatelliteImageTileID": [pk for pk, _, _ in rows]}
+        properties = [eodag_data.get("properties", {}) for _, _, eodag_data in rows]
+        for column, property_name in METADATA_PROPERTIES.items():
+            columns[column] = [tile_properties.get(property_name) for tile_properties in properties]
+
+        # Outer ring of each footprint, the first polygon of a MultiPolygon
+        rings = []
+        for _, _, eodag_data in rows:
+            geometry = eodag_data["geometry"]
+            if geometry["type"] == "MultiPolygon":
+                rings.append(geometry["coordinates"][0][0])
+            elif geometry["type"] == "Polygon":
+                rings.append(geometry["coordinates"][0])
+            else:
+                raise ValueError("Unexpected geometry type and type is:", geometry["type"])
+
+        if rings:
+            import numpy
+            import shapely
+
+            ring_coordinates = numpy.concatenate([numpy.asarray(ring)[:, :2] for ring in rings])
+            ring_indices = numpy.repeat(numpy.arange(len(rings)), [len(ring) for ring in rings])
+            extents = shapely.to_wkb(
+                shapely.polygons(shapely.linearrings(ring_coordinates, indices=ring_indices))
+            )
+        else:
+            extents = []
+        columns["Extent"] = [GEOSGeometry(memoryview(wkb), srid=4326) for wkb in extents]
+
+        log(
+            f"Fetched metadata for {len(rows)} satellite image tiles.",
+            level=logging.DEBUG,
+            MethodName=self.fetch_metadata_batch.__qualname__,
+            StatusCode=200,
+        )
+        return columns
+
+    @staticmethod
+    def save_metadata_batch(
+        metadata_model, columns: Dict[str, list], tile_field=None, batch_size=None, **fields
+    ):
+        """Write the rows of fetch_metadata_batch with a single bulk_create.
+
+        tile_field names the metadata model's foreign key to SatelliteImageTile,
+        if any; fields are set on every row."""
+        columns = dict(columns)
+        tile_ids = columns.pop("SatelliteImageTileID")
+
+        objects = []
+        for tile_id, values in zip(tile_ids, zip(*columns.values())):
+            row = dict(zip(columns, values), **fields)
+            if tile_field:
+                row[f"{tile_field}_id"] = tile_id
+            objects.append(metadata_model(**row))
+        return metadata_model.objects.bulk_create(
+            objects, batch_size=batch_size or getattr(settings, "TILE_INGEST_BATCH_SIZE", 500)
+        )
+
+    @timed_stage("fetch_target_images")
     def fetch_target_images(
         self, sat_image_tile: SatelliteImageTile, source_data: SourceData
     ):
@@ -405,85 +956,36 @@ class SentinelTileService:
 
         folder_path = sat_image_tile.extracted_path
 
-        if sat_image_tile.Product == PRODUCT_SENTINEL2:
-            log(
-                "Fetching images for Sentinel 2 tile.",
-                sat_image_tile=sat_image_tile,
-                source_data=source_data,
-                level=logging.DEBUG,
-                MethodName=self.fetch_target_images.__qualname__,StatusCode=100
-            ),
-            # granule_folder = os.path.join(folder_path, os.listdir(folder_path)[0], 'GRANULE')
-            # image_folder = os.path.join(granule_folder, os.listdir(granule_folder)[0], 'IMG_DATA')
-
-            target_images = []
+        # Read the product store's extraction, shared with the tiles of other
+        # collection requests
+        store = get_product_store()
+        if store is not None:
+            folder_path = (
+                store.find_extracted(product_key(sat_image_tile.eodag_data), folder_path)
+                or folder_path
+            )
 
+        if sat_image_tile.Product in (PRODUCT_SENTINEL2, PRODUCT_SENTINEL1):
+            try:
+                target_images = band_manifest(
+                    folder_path, sat_image_tile.Product, key=sat_image_tile.tile_id
+                )
+            except ValueError as e:
+                log(
+                    f"No target images found in {folder_path}: {e}",
+                    sat_image_tile=sat_image_tile,
+                    source_data=source_data,
+                    level=logging.ERROR,
+                    MethodName=self.fetch_target_images.__qualname__,StatusCode=404
+                )
+                raise Exception(f"No target images found in {folder_path}: {e}")
             log(
-                "Checking every image in sentinel tile image folder.",
+                f"Found {len(target_images)} target images in the band manifest of {folder_path}.",
                 sat_image_tile=sat_image_tile,
                 source_data=source_data,
                 level=logging.DEBUG,
                 MethodName=self.fetch_target_images.__qualname__,StatusCode=100
-            ),
-            for image in os.listdir(folder_path):
-                item_path = os.path.join(folder_path, image)
-
-                # Check if it's a file
-                if os.path.isfile(item_path):
-                    # Generate a unique identifier (UUID)
-                    unique_identifier = str(uuid.uuid4())
-
-                    # Get the band name from the original filename
-                    band_name = os.path.splitext(image)[0].split("_")[-1]
-
-                    # Extract the extension from the original filename
-                    extension = os.path.splitext(image)[1]
-
-                    # Construct the new filename
-                    new_filename = f"{unique_identifier}_{band_name}{extension}"
-
-                    # Create the new file path
-                    new_item_path = os.path.join(folder_path, new_filename)
-
-                    # Rename the file
-                    try:
-                        os.rename(item_path, new_item_path)
-
-                    except Exception as e:
-                        log(
-                            f"Error in renaming '{item_path}': {e} and {traceback.format_exc()}",
-                            sat_image_tile=sat_image_tile,
-                            source_data=source_data,
-                            level=logging.DEBUG,
-                            MethodName=self.fetch_target_images.__qualname__,StatusCode=500
-                        )
-
-                    # Add the renamed file to target_images
-                    image_data = {
-                        "Path": new_item_path,
-                        "BandName": band_name,
-                    }
-                    log(
-                        f"File name is renamed and added to target_images list and file data is: {image_data}",
-                        sat_image_tile=sat_image_tile,
-                        source_data=source_data,
-                        level=logging.DEBUG,
-                        MethodName=self.fetch_target_images.__qualname__,StatusCode=100
-                    )
-                    target_images.append(image_data)
-
-        elif sat_image_tile.Product == PRODUCT_SENTINEL1:
-            # granule_folder = os.path.join(folder_path, os.listdir(folder_path)[0], 'GRANULE')
-            # image_folder = os.path.join(granule_folder, os.listdir(granule_folder)[0], 'IMG_DATA')
-
-            # target_images = []
-            # for image in os.listdir(image_folder):
-            #     image_data = {
-            #         'Path': os.path.join(image_folder, image),
-            #         'BandName': os.path.splitext(image)[0].split("_")[-1]
-            #     }
-            #     target_images.append(image_data)
-            pass
+            )
         else:
             log(
                 f"No fetching logic found for product type {sat_image_tile.Product}.",
@@ -502,10 +1004,149 @@ class SentinelTileService:
 
         return target_images
 
+    @timed_stage(
+        "cog",
+        bytes_from=lambda results, arguments: sum(
+            result["Stats"]["BytesWritten"] for result in results if result["Success"]
+        ),
+    )
+    def generate_cogs(
+        self,
+        sat_image_tile: SatelliteImageTile,
+        source_data: SourceData,
+        target_images: List[dict] = None,
+        output_dir: str = None,
+        product_path: str = None,
+    ) -> List[dict]:
+        """Convert the target images of a tile to COG band by band in parallel.
+
+        Without target_images the bands come from the band manifest of the
+        tile's extracted_path when it exists, otherwise straight out of the downloaded zip at
+        product_path through /vsizip/, with no extraction pass.
+        With the product store configured, bands come from the stored
+        extraction or product, COGs are written to its cogs folder by default, and bands whose COG is
+        already there are reused with Reused=True instead of converted again.
+        Failed bands are logged and returned with Success=False. Raises when
+        the tile has neither an extracted folder nor a downloaded product."""
+        store = get_product_store()
+        key = product_key(sat_image_tile.eodag_data) if store is not None else None
+
+        if target_images is None:
+            extracted_path = sat_image_tile.extracted_path
+            if key:
+                extracted_path = store.find_extracted(key, extracted_path) or extracted_path
+                product_path = product_path or store.product_path(key)
+            if extracted_path and os.path.isdir(extracted_path):
+                target_images = band_manifest(
+                    extracted_path,
+                    sat_image_tile.Product,
+                    key=sat_image_tile.tile_id,
+                )
+            elif product_path and os.path.exists(product_path):
+                target_images = band_sources(product_path)
+            else:
+                message = (
+                    f"No extracted folder or downloaded product found for tile "
+                    f"{sat_image_tile.tile_id}, cannot generate its COGs."
+                )
+                log(
+                    message,
+                    sat_image_tile=sat_image_tile,
+                    source_data=source_data,
+                    level=logging.ERROR,
+                    MethodName=self.generate_cogs.__qualname__,
+                    StatusCode=404,
+                )
+                raise Exception(message)
+
+        reused = []
+        if key:
+            output_dir = output_dir or store.cog_dir(key)
+            pending = []
+            for target_image in target_images:
+                cog_path = cog_path_for(target_image["Path"], output_dir)
+                if os.path.isfile(cog_path):
+                    reused.append(
+                        {
+                            "BandName": target_image["BandName"],
+                            "Path": target_image["Path"],
+                            "CogPath": cog_path,
+                            "Success": True,
+                            "Reused": True,
+                            "Seconds": 0.0,
+                            "Stats": {"SourceBytes": 0, "BytesWritten": 0},
+                            "Error": None,
+                        }
+                    )
+                else:
+                    pending.append(target_image)
+            target_images = pending
+
+        results = reused + generate_product_cogs(
+            target_images,
+            output_dir=output_dir,
+            gdal_cache_mb=getattr(settings, "COG_GDAL_CACHE_MB", None),
+            scratch=self.cog_scratch_area(),
+            cpu_tokens=CpuTokens(
+                getattr(settings, "COG_CPU_TOKEN_DIR", None),
+                getattr(settings, "COG_CPU_BUDGET", None),
+            ),
+        )
+
+        for result in results:
+            if result.get("Reused"):
+                log(
+                    f"COG for band {result['BandName']} reused from the product store: "
+                    f"{result['CogPath']}",
+                    sat_image_tile=sat_image_tile,
+                    source_data=source_data,
+                    level=logging.DEBUG,
+                    MethodName=self.generate_cogs.__qualname__,
+                    StatusCode=200,
+                )
+            elif result["Success"]:
+                log(
+                    f"COG generated for band {result['BandName']} in "
+                    f"{result['Seconds']:.2f} seconds: {result['CogPath']} "
+                    f"({result['Stats']['SourceBytes']} source bytes, "
+                    f"{result['Stats']['BytesWritten']} bytes written)",
+                    sat_image_tile=sat_image_tile,
+                    source_data=source_data,
+                    level=logging.DEBUG,
+                    MethodName=self.generate_cogs.__qualname__,
+                    StatusCode=200,
+                )
+            else:
+                log(
+                    f"Error while generating COG for band {result['BandName']}: {result['Error']}",
+                    sat_image_tile=sat_image_tile,
+                    source_data=source_data,
+                    level=logging.ERROR,
+                    MethodName=self.generate_cogs.__qualname__,
+                    StatusCode=500,
+                )
+
+        if key and len(results) > len(reused):
+            store.record_size(key)
+        return results
+
+    @staticmethod
+    def cog_scratch_area():
+        """Local scratch area for NAS-bound COG generation, None when COG_SCRATCH_DIR
+        is not configured or COGs are generated on the local machine."""
+        scratch_dir = getattr(settings, "COG_SCRATCH_DIR", None)
+        if not scratch_dir or getattr(settings, "GENERATE_COG_ON_LOCAL", False):
+            return None
+        return ScratchArea(
+            scratch_dir, quota_bytes=getattr(settings, "COG_SCRATCH_QUOTA_BYTES", None)
+        )
+
     def find_epsg(self, target_image_path: str) -> str:
         """This is for a hot fix where for the sentinel image,
         we can't get epsg code until extracted. To remove this and
         do this properly. move image extraction logic before metadata reading."""
 
+        import rasterio
+
         with rasterio.open(target_image_path) as dataset:
             return str(dataset.crs.to_epsg())
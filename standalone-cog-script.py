@@ -1,7 +1,18 @@
 import os
-import subprocess
 import time
 
+import rasterio
+import rasterio.shutil
+
+# Same creation options as the service's cog_generator
+COG_CREATION_OPTIONS = {
+    "PREDICTOR": "2",
+    "BIGTIFF": "YES",
+    "BLOCKSIZE": "128",
+}
+# Holds a block row of decoded 1024x1024 JP2 tiles, so each is decoded once
+GDAL_CACHE_MB = 64
+
 def filter_pair_files(input_file, pair_files):
     """
     Filter and return only the pair files that are present for the given input file.
@@ -27,38 +38,26 @@ def filter_pair_files(input_file, pair_files):
     return existing_files
 
 def generate_cog(input_file, output_file):
-    output_format = "COG"
-    output_format_options = [
-        "PREDICTOR=2",
-        "BIGTIFF=YES",
-        "NUM_THREADS=ALL_CPUS",
-        "BLOCKSIZE=128",
-#        "TILED=YES"
-    ]
-
+    num_threads = str(os.cpu_count() or 1)
     try:
-        # Construct the gdal_translate command
-        command = [
-            "gdal_translate",
-            "-of", output_format,
-        ]
-        for option in output_format_options:
-            command.extend(["-co", option])
-        command.extend([input_file, output_file])
-
-        # Record start time
         start_time = time.time()
-
-        # Run the command and wait for it to complete
-        subprocess.run(command, check=True)
-
-        # Record end time
-        end_time = time.time()
-        elapsed_time = end_time - start_time
+        with rasterio.Env(GDAL_NUM_THREADS=num_threads, GDAL_CACHEMAX=GDAL_CACHE_MB):
+            rasterio.shutil.copy(
+                input_file,
+                output_file,
+                driver="COG",
+                NUM_THREADS=num_threads,
+                **COG_CREATION_OPTIONS,
+            )
+        elapsed_time = time.time() - start_time
 
         print(f"COG generation completed: {output_file}")
         print(f"Time taken: {elapsed_time:.2f} seconds")
-    except subprocess.CalledProcessError as e:
+        print(
+            f"{os.path.getsize(input_file)} source bytes, "
+            f"{os.path.getsize(output_file)} bytes written"
+        )
+    except Exception as e:
         print(f"Error during COG generation: {e}")
 
 # Main logic
@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+if not os.environ.get("DJANGO_SETTINGS_MODULE"):
+    pytest.skip("needs the project's Django settings", allow_module_level=True)
+
+django = pytest.importorskip("django")
+requests = pytest.importorskip("requests")
+django.setup()
+
+from benchmark_pipeline import RECORDED_SEARCH, StandInProvider
+from SatProductCurator.models import SatelliteProviderConfiguration
+from SatProductCurator.services.hedged_search import (
+    MIN_SAMPLES,
+    HedgedSearch,
+    ProviderStats,
+    product_name,
+)
+
+ITEMS_PER_PAGE = 20
+
+
+@pytest.fixture
+def providers(tmp_path):
+    product_path = tmp_path / "product.zip"
+    product_path.write_bytes(b"product")
+    providers = {}
+    for name in ("peps", "creodias"):
+        provider = StandInProvider(RECORDED_SEARCH, str(product_path))
+        provider.total_results = 12
+        provider.start()
+        providers[name] = provider
+    yield providers
+    for provider in providers.values():
+        provider.stop()
+
+
+@pytest.fixture
+def stats(tmp_path):
+    stats = ProviderStats(str(tmp_path / "provider_stats.sqlite3"))
+    # Recorded history, so the hedge delay is 0.5 s and the timeout the minimum
+    for name in ("peps", "creodias"):
+        for _ in range(MIN_SAMPLES):
+            stats.record(name, 0.5, True)
+    return stats
+
+
+def stand_in_search(providers):
+    def search(config, **search_kwargs):
+        response = requests.get(
+            f"{providers[config.SATProviderName].base_url}/search.json",
+            params={"maxRecords": ITEMS_PER_PAGE, "page": 1},
+            timeout=30,
+        )
+        response.raise_for_status()
+        body = response.json()
+        return body["features"], body["properties"]["totalResults"]
+
+    return search
+
+
+def hedged_search(providers, stats):
+    configs = [SatelliteProviderConfiguration(SATProviderName=name) for name in providers]
+    return HedgedSearch(configs, stats, search_provider=stand_in_search(providers))
+
+
+def test_fast_primary_is_not_hedged(providers, stats):
+    results, complete = hedged_search(providers, stats).search(productType="S2_MSI_L1C")
+
+    assert complete
+    assert len(results["features"]) == 12
+    assert providers["peps"].search_requests == 1
+    assert providers["creodias"].search_requests == 0
+
+
+def test_slow_primary_is_hedged_to_the_next_provider(providers, stats):
+    providers["peps"].search_delay = 5.0
+
+    start = time.monotonic()
+    results, complete = hedged_search(providers, stats).search(productType="S2_MSI_L1C")
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 2.0
+    assert complete
+    assert len({product_name(feature) for feature in results["features"]}) == 12
+    assert providers["creodias"].search_requests == 1
+    assert stats.summary("creodias")["Samples"] == MIN_SAMPLES + 1
+
+
+def test_failing_primary_falls_back_and_is_recorded(providers, stats):
+    providers["peps"].search_error = 503
+
+    results, _ = hedged_search(providers, stats).search(productType="S2_MSI_L1C")
+
+    assert len(results["features"]) == 12
+    assert stats.summary("peps")["ErrorRate"] > 0
+
+
+def test_every_provider_failing_raises(providers, stats):
+    for provider in providers.values():
+        provider.search_error = 503
+
+    with pytest.raises(requests.HTTPError):
+        hedged_search(providers, stats).search(productType="S2_MSI_L1C")
+
+
+def test_partial_answer_is_reported_incomplete(providers, stats):
+    for provider in providers.values():
+        provider.total_results = ITEMS_PER_PAGE * 2
+
+    results, complete = hedged_search(providers, stats).search(productType="S2_MSI_L1C")
+
+    assert len(results["features"]) == ITEMS_PER_PAGE
+    assert not complete
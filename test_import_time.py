@@ -0,0 +1,21 @@
+import argparse
+import os
+
+import pytest
+
+if not os.environ.get("DJANGO_SETTINGS_MODULE"):
+    pytest.skip("needs the project's Django settings", allow_module_level=True)
+
+pytest.importorskip("django")
+
+from benchmark_pipeline import measure_import_time
+
+# Same budget as the benchmark's --import-budget
+IMPORT_BUDGET = 0.5
+
+
+def test_tile_service_imports_quickly_without_heavy_dependencies():
+    result = measure_import_time(argparse.Namespace(repeat=3, import_budget=IMPORT_BUDGET))
+
+    assert result["heavy_modules"] == []
+    assert result["median_seconds"] <= IMPORT_BUDGET
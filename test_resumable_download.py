@@ -0,0 +1,58 @@
+import hashlib
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+
+from benchmark_pipeline import RECORDED_SEARCH, StandInProvider
+
+try:
+    from SatProductCurator.services.resumable_download import download_resumable
+except ImportError:
+    from resumable_download import download_resumable
+
+PRODUCT_SIZE = 3 * 1024 * 1024 + 17
+DROP_AFTER = 2 * 1024 * 1024 + 512 * 1024
+
+
+@pytest.fixture
+def provider(tmp_path):
+    product_path = tmp_path / "product.zip"
+    product_path.write_bytes(os.urandom(PRODUCT_SIZE))
+    provider = StandInProvider(RECORDED_SEARCH, str(product_path), drop_after=DROP_AFTER)
+    provider.start()
+    yield provider
+    provider.stop()
+
+
+def test_resumes_from_the_partial_file_after_a_dropped_connection(provider, tmp_path):
+    url = f"{provider.base_url}/download/product"
+    destination = str(tmp_path / "downloaded.zip")
+
+    with pytest.raises(Exception):
+        download_resumable(
+            url,
+            destination,
+            expected_size=PRODUCT_SIZE,
+            checksum=provider.product_checksum,
+        )
+    # Whole chunks received before the drop are kept
+    received = os.path.getsize(f"{destination}.part")
+    assert 0 < received <= DROP_AFTER
+    assert not os.path.exists(destination)
+
+    download_resumable(
+        url,
+        destination,
+        expected_size=PRODUCT_SIZE,
+        checksum=provider.product_checksum,
+    )
+
+    assert provider.product_requests == [
+        (None, DROP_AFTER),
+        (f"bytes={received}-", PRODUCT_SIZE - received),
+    ]
+    with open(destination, "rb") as downloaded:
+        assert hashlib.md5(downloaded.read()).hexdigest() == provider.product_checksum
+    assert not os.path.exists(f"{destination}.part")
@@ -0,0 +1,194 @@
+"""Claim-based work queue over the pipeline tables.
+
+Workers on every host poll the same tables. Instead of each one reading
+"not downloaded, order by ID" and racing the others, a worker claims rows
+with SELECT ... FOR UPDATE SKIP LOCKED and stamps them with its id and a
+lease expiry. Rows locked or leased by other workers are skipped, so N
+workers drain the backlog in parallel without doing the same item twice.
+A heartbeat renews the lease while the item is processed; a worker that
+dies simply lets its lease expire and the item becomes claimable again.
+
+The claimed models need three fields (added by migration):
+    claimed_by = models.CharField(max_length=255, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    priority = models.IntegerField(default=0, db_index=True)
+"""
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from IngestionEngine.workers._base_logger import Logger
+from SatProductCurator.models import NewCollectionRequest, SatelliteImageTile
+
+log = Logger("WorkQueue").get_logger()
+
+DEFAULT_LEASE_SECONDS = 300
+
+
+def worker_id() -> str:
+    """host:pid:thread, unique per worker across the app hosts."""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+class WorkQueue:
+    def __init__(
+        self,
+        model,
+        eligible: Q,
+        name: Optional[str] = None,
+        lease_seconds: Optional[int] = None,
+        claimed_by: Optional[str] = None,
+    ) -> None:
+        self.model = model
+        self.eligible = eligible
+        self.name = name or model.__name__
+        self.lease_seconds = lease_seconds or getattr(
+            settings, "WORK_QUEUE_LEASE_SECONDS", DEFAULT_LEASE_SECONDS
+        )
+        self.claimed_by = claimed_by or worker_id()
+
+    def _lease_expiry(self):
+        return timezone.now() + timedelta(seconds=self.lease_seconds)
+
+    def claim(self, limit: int = 1, exclude=()) -> list:
+        """Atomically claim up to limit eligible rows, highest priority first,
+        skipping rows that are locked or under a live lease and the pks in exclude."""
+        with transaction.atomic():
+            ids = list(
+                self.model.objects.select_for_update(skip_locked=True)
+                .filter(self.eligible)
+                .filter(Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=timezone.now()))
+                .exclude(pk__in=list(exclude))
+                .order_by("-priority", "pk")
+                .values_list("pk", flat=True)[:limit]
+            )
+            if not ids:
+                return []
+            self.model.objects.filter(pk__in=ids).update(
+                claimed_by=self.claimed_by, lease_expires_at=self._lease_expiry()
+            )
+
+        claimed = list(self.model.objects.filter(pk__in=ids).order_by("-priority", "pk"))
+        log(
+            f"{self.claimed_by} claimed {len(claimed)} {self.name} items.",
+            level=logging.DEBUG,
+            MethodName=self.claim.__qualname__,
+            StatusCode=200,
+        )
+        return claimed
+
+    def heartbeat(self, items: list) -> bool:
+        """Renew the lease on items still held by this worker. Returns False
+        when a lease was lost, i.e. it expired and another worker claimed the item."""
+        renewed = self.model.objects.filter(
+            pk__in=[item.pk for item in items], claimed_by=self.claimed_by
+        ).update(lease_expires_at=self._lease_expiry())
+        return renewed == len(items)
+
+    def release(self, items: list) -> None:
+        """Give items back, e.g. once processed or after a failure."""
+        self.model.objects.filter(
+            pk__in=[item.pk for item in items], claimed_by=self.claimed_by
+        ).update(claimed_by=None, lease_expires_at=None)
+
+    @contextmanager
+    def leased(self, items: list):
+        """Keep renewing the lease on items in the background while the block runs,
+        then release them."""
+        stop = threading.Event()
+
+        def renew():
+            try:
+                while not stop.wait(self.lease_seconds / 3):
+                    if not self.heartbeat(items):
+                        log(
+                            f"{self.claimed_by} lost the lease on some {self.name} items.",
+                            level=logging.WARNING,
+                            MethodName=self.leased.__qualname__,
+                            StatusCode=409,
+                        )
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=renew, name=f"lease-{self.name}", daemon=True)
+        thread.start()
+        try:
+            yield items
+        finally:
+            stop.set()
+            thread.join()
+            self.release(items)
+
+    def drain(self, process: Callable, batch_size: int = 1, max_items: Optional[int] = None) -> int:
+        """Claim and process items until the queue is empty or max_items were
+        attempted. Failures are logged and the item released so another worker
+        or a later run can retry it; this run doesn't claim it again. Returns
+        the number processed successfully."""
+        attempted = 0
+        succeeded = 0
+        failed = set()
+        while max_items is None or attempted < max_items:
+            limit = batch_size if max_items is None else min(batch_size, max_items - attempted)
+            items = self.claim(limit, exclude=failed)
+            if not items:
+                break
+            with self.leased(items):
+                for item in items:
+                    attempted += 1
+                    try:
+                        process(item)
+                    except Exception as e:
+                        failed.add(item.pk)
+                        log(
+                            f"Error while processing {self.name} item {item.pk}: {e}",
+                            level=logging.ERROR,
+                            MethodName=self.drain.__qualname__,
+                            StatusCode=500,
+                        )
+                    else:
+                        succeeded += 1
+        return succeeded
+
+
+def download_queue(**kwargs) -> WorkQueue:
+    """Tiles marked to be downloaded, not downloaded yet, that still have
+    download attempts left."""
+    return WorkQueue(
+        SatelliteImageTile,
+        Q(to_be_downloaded=True)
+        & Q(is_downloaded=False)
+        & Q(dl_attempts__lt=getattr(settings, "DOWNLOAD_MAX_ATTEMPTS", 3)),
+        name="download",
+        **kwargs,
+    )
+
+
+def search_queue(**kwargs) -> WorkQueue:
+    """Accepted collection requests whose search hasn't completed."""
+    return WorkQueue(
+        NewCollectionRequest,
+        Q(IsAccepted=True) & Q(IsSearchSuccessful=False),
+        name="search",
+        **kwargs,
+    )
+
+
+def cog_queue(pending: Q, **kwargs) -> WorkQueue:
+    """Downloaded tiles whose COGs are still to be generated. SatelliteImageTile
+    has no COG state of its own, so pending is the COG worker's eligibility
+    check, e.g. the flag its eligible_item_reader tests."""
+    return WorkQueue(
+        SatelliteImageTile,
+        Q(is_downloaded=True) & pending,
+        name="cog",
+        **kwargs,
+    )